@@ -0,0 +1,99 @@
+"""Deterministic generation of the documents the benchmarks are run against"""
+import os
+from os.path import join
+from random import Random
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+    'et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip '
+    'ex ea commodo consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat nulla'
+).split()
+
+CODE = '''def {name}(values, threshold={n}):
+    """Return the values above threshold, doubled"""
+    result = []
+    for value in values:
+        if value > threshold:
+            result.append(value * 2)
+    return sorted(result, key=lambda it: -it)
+'''
+
+
+def _sentence(rng: Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+    if rng.random() < 0.2:
+        words[rng.randrange(len(words))] = f'**{rng.choice(WORDS)}**'
+    if rng.random() < 0.1:
+        words[rng.randrange(len(words))] = f'[{rng.choice(WORDS)}](https://example.com/{rng.choice(WORDS)})'
+    return ' '.join(words).capitalize() + '.'
+
+
+def _paragraph(rng: Random) -> str:
+    return ' '.join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+
+
+def markdown(rng: Random, size: int, code_ratio: float = 0.0) -> str:
+    """Markdown text of about size bytes, with a code_ratio share of fenced Python blocks"""
+    parts = [f'# {_sentence(rng)}']
+    length = len(parts[0])
+    while length < size:
+        roll = rng.random()
+        if roll < code_ratio:
+            part = '```python\n' + CODE.format(name=rng.choice(WORDS), n=rng.randint(0, 100)) + '```'
+        elif roll < code_ratio + 0.1:
+            part = f'## {_sentence(rng)}'
+        elif roll < code_ratio + 0.2:
+            part = '\n'.join(f'- {_sentence(rng)}' for _ in range(rng.randint(2, 6)))
+        elif roll < code_ratio + 0.25:
+            part = '| a | b | c |\n|---|---|---|\n' + '\n'.join(
+                f'| {rng.choice(WORDS)} | {rng.randint(0, 999)} | {rng.choice(WORDS)} |' for _ in range(5)
+            )
+        else:
+            part = _paragraph(rng)
+        parts.append(part)
+        length += len(part) + 2
+    return '\n\n'.join(parts) + '\n'
+
+
+def graph(rng: Random, nodes: int) -> str:
+    edges = '\n'.join(f'  n{rng.randrange(nodes)} -> n{rng.randrange(nodes)};' for _ in range(nodes * 2))
+    return f'digraph G {{\n{edges}\n}}\n'
+
+
+def _write(path: str, content: str) -> None:
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def generate(root: str,
+             seed: int = 0,
+             small: int = 200,
+             huge: int = 3,
+             huge_size: int = 512 * 1024,
+             code: int = 5,
+             directory_entries: int = 5000,
+             graphs: int = 10) -> dict[str, list[str]]:
+    """Write the corpus below root, returns the URL paths of the documents of every kind"""
+    rng = Random(seed)
+    corpus: dict[str, list[str]] = {'small': [], 'huge': [], 'code': [], 'directory': [], 'graph': []}
+    for kind in ('small', 'huge', 'code', 'big', 'graphs'):
+        os.makedirs(join(root, kind), exist_ok=True)
+    for i in range(small):
+        _write(join(root, 'small', f'{i:04d}.md'), markdown(rng, rng.randint(1024, 4096)))
+        corpus['small'].append(f'/small/{i:04d}.md')
+    for i in range(huge):
+        _write(join(root, 'huge', f'{i:02d}.md'), markdown(rng, huge_size))
+        corpus['huge'].append(f'/huge/{i:02d}.md')
+    for i in range(code):
+        _write(join(root, 'code', f'{i:02d}.md'), markdown(rng, 64 * 1024, code_ratio=0.5))
+        corpus['code'].append(f'/code/{i:02d}.md')
+    for i in range(directory_entries):
+        if i % 50 == 0:
+            os.makedirs(join(root, 'big', f'dir{i:05d}'), exist_ok=True)
+        else:
+            _write(join(root, 'big', f'{i:05d}.md'), f'# {i}\n')
+    corpus['directory'].append('/big/')
+    for i in range(graphs):
+        _write(join(root, 'graphs', f'{i:02d}.dot'), graph(rng, rng.randint(20, 80)))
+        corpus['graph'].append(f'/graphs/{i:02d}.dot')
+    return corpus
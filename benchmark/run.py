@@ -0,0 +1,289 @@
+"""Benchmark of bugis.asgi.application, driven in-process by a synthetic ASGI client.
+
+    python benchmark/run.py --output results.json [--baseline previous.json]
+
+The corpus is generated in a temporary directory (or --corpus) from a fixed seed, so that runs on
+different commits measure the same work. The server is configured through the usual BUGIS_*
+environment variables.
+"""
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from os.path import abspath, dirname, join
+from shutil import which
+from time import perf_counter
+from typing import Any, Iterable, Optional
+
+from corpus import generate
+
+
+def _rss() -> int:
+    """Resident set size in bytes of this process and of its children"""
+    total = 0
+    pids = [os.getpid()]
+    try:
+        with open(f'/proc/{os.getpid()}/task/{os.getpid()}/children') as f:
+            pids += [int(it) for it in f.read().split()]
+    except OSError:
+        pass
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            if pid == os.getpid():
+                # Not on Linux, fall back to the peak
+                return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return total
+
+
+def _percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def _summary(latencies: list[float], elapsed: float, rss_before: int, statuses: dict[int, int]) -> dict[str, Any]:
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'mean': sum(latencies) / len(latencies),
+        'p50': _percentile(latencies, 0.5),
+        'p99': _percentile(latencies, 0.99),
+        'max': max(latencies),
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'rss': _rss(),
+        'rss_delta': _rss() - rss_before,
+    }
+
+
+class Client:
+    """Minimal ASGI client calling the application directly"""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def request(self, path: str, query: bytes = b'', headers: Iterable[tuple[str, str]] = ()) \
+            -> tuple[int, dict[bytes, bytes], int]:
+        status = 0
+        response_headers: dict[bytes, bytes] = {}
+        size = 0
+
+        async def send(message: dict) -> None:
+            nonlocal status, response_headers, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                response_headers = {k.lower(): v for k, v in message.get('headers', ())}
+            else:
+                size += len(message.get('body', b''))
+
+        async def receive() -> dict:
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': path,
+            'query_string': query,
+            'headers': [(k.encode(), v.encode()) for k, v in headers],
+        }
+        await self.application(scope, receive, send)
+        return status, response_headers, size
+
+    async def subscribe(self, path: str, connected: asyncio.Event, changes: asyncio.Queue,
+                        disconnect: asyncio.Event) -> None:
+        """Follow the hot reload event stream of path, putting the arrival time of every change in changes"""
+        requested = False
+
+        async def send(message: dict) -> None:
+            body = message.get('body', b'')
+            if body.startswith(b'retry:'):
+                connected.set()
+            elif body.startswith(b'event: change'):
+                changes.put_nowait(perf_counter())
+
+        async def receive() -> dict:
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'events', 'headers': []}
+        await self.application(scope, receive, send)
+
+    async def startup(self) -> None:
+        self._lifespan_receive = asyncio.Queue()
+        self._lifespan_send = asyncio.Queue()
+        self._lifespan = asyncio.ensure_future(
+            self.application({'type': 'lifespan'}, self._lifespan_receive.get, self._lifespan_send.put)
+        )
+        await self._lifespan_event('startup')
+
+    async def shutdown(self) -> None:
+        await self._lifespan_event('shutdown')
+        await self._lifespan
+
+    async def _lifespan_event(self, event: str) -> None:
+        self._lifespan_receive.put_nowait({'type': f'lifespan.{event}'})
+        message = await self._lifespan_send.get()
+        if message['type'].endswith('.failed'):
+            raise RuntimeError(message.get('message'))
+
+
+async def load(client: Client,
+               paths: list[str],
+               concurrency: int,
+               query: bytes = b'',
+               headers: Optional[dict[str, list[tuple[str, str]]]] = None) -> dict[str, Any]:
+    """Request every path once with concurrency requests in flight"""
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    queue = list(reversed(paths))
+    rss_before = _rss()
+
+    async def worker() -> None:
+        while queue:
+            path = queue.pop()
+            start = perf_counter()
+            status, _, _ = await client.request(path, query, (headers or {}).get(path, ()))
+            latencies.append(perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _summary(latencies, perf_counter() - start, rss_before, statuses)
+
+
+async def fan_out(client: Client, root: str, path: str, subscribers: int, rounds: int) -> dict[str, Any]:
+    """Latency between a change of path and its notification to every subscriber of its event stream"""
+    disconnect = asyncio.Event()
+    connections = [asyncio.Event() for _ in range(subscribers)]
+    changes = [asyncio.Queue() for _ in range(subscribers)]
+    rss_before = _rss()
+    tasks = [
+        asyncio.ensure_future(client.subscribe(path, connected, queue, disconnect))
+        for connected, queue in zip(connections, changes)
+    ]
+    await asyncio.gather(*(it.wait() for it in connections))
+    latencies: list[float] = []
+    start = perf_counter()
+    for i in range(rounds):
+        with open(join(root, path.lstrip('/')), 'a') as f:
+            f.write(f'\nChange {i}\n')
+        changed = perf_counter()
+        received = await asyncio.wait_for(asyncio.gather(*(it.get() for it in changes)), 30)
+        latencies += [it - changed for it in received]
+        # Let the notification window of the file watcher close before the next change
+        await asyncio.sleep(0.2)
+    elapsed = perf_counter() - start
+    disconnect.set()
+    await asyncio.gather(*tasks)
+    result = _summary(latencies, elapsed, rss_before, {200: subscribers})
+    result['subscribers'] = subscribers
+    return result
+
+
+async def run(root: str, corpus: dict[str, list[str]], concurrency: int, subscribers: int, rounds: int) \
+        -> dict[str, dict[str, Any]]:
+    from bugis import asgi
+    client = Client(asgi.application)
+    await client.startup()
+    results: dict[str, dict[str, Any]] = {}
+    kinds = ['small', 'huge', 'code'] + (['graph'] if which('dot') else [])
+    for kind in kinds:
+        paths = corpus[kind]
+        results[f'cold/{kind}'] = await load(client, paths, concurrency)
+        etags: dict[str, list[tuple[str, str]]] = {}
+        for path in paths:
+            # Also fills the cache of the compressed variants used by the warm requests
+            _, headers, _ = await client.request(path, headers=[('accept-encoding', 'gzip')])
+            etags[path] = [('if-none-match', headers[b'etag'].decode())]
+        repeat = max(1, 1000 // len(paths))
+        results[f'warm/{kind}'] = await load(client, paths * repeat, concurrency,
+                                             headers={k: [('accept-encoding', 'gzip')] for k in paths})
+        results[f'not_modified/{kind}'] = await load(client, paths * repeat, concurrency, headers=etags)
+    listing = corpus['directory'] * 100
+    results['listing/cold'] = await load(client, corpus['directory'], 1)
+    results['listing/warm'] = await load(client, listing, concurrency)
+    results['reload/fan_out'] = await fan_out(client, root, corpus['small'][0], subscribers, rounds)
+    await client.shutdown()
+    return results
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=dirname(abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _report(results: dict[str, dict[str, Any]], baseline: Optional[dict[str, dict[str, Any]]]) -> None:
+    print(f'{"scenario":<24}{"requests":>9}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"rss MiB":>9}')
+    for name, result in results.items():
+        print(f'{name:<24}{result["requests"]:>9}{result["throughput"]:>10.1f}'
+              f'{result["p50"] * 1000:>10.2f}{result["p99"] * 1000:>10.2f}{result["rss"] / 0x100000:>9.1f}')
+        previous = (baseline or {}).get(name)
+        if previous:
+            print(f'{"  vs baseline":<33}{result["throughput"] / previous["throughput"]:>10.2f}x'
+                  f'{result["p50"] / previous["p50"]:>9.2f}x{result["p99"] / previous["p99"]:>9.2f}x')
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Benchmark the bugis ASGI application')
+    parser.add_argument('--output', help='file the JSON results are written to')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--corpus', help='directory the corpus is generated in, a temporary one by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of the number and size of documents')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--subscribers', type=int, default=200, help='hot reload subscribers of a single document')
+    parser.add_argument('--rounds', type=int, default=10, help='changes notified to the subscribers')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        root = abspath(args.corpus or temporary)
+        os.makedirs(root, exist_ok=True)
+        corpus = generate(root,
+                          seed=args.seed,
+                          small=max(1, int(200 * args.scale)),
+                          huge=max(1, int(3 * args.scale)),
+                          huge_size=int(512 * 1024 * args.scale),
+                          code=max(1, int(5 * args.scale)),
+                          directory_entries=max(1, int(5000 * args.scale)),
+                          graphs=max(1, int(10 * args.scale)))
+        # The server serves and watches its working directory
+        os.chdir(root)
+        os.environ.setdefault('BUGIS_WARM_UP', 'true')
+        results = asyncio.run(run(root, corpus, args.concurrency, args.subscribers, args.rounds))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    _report(results, baseline)
+    if args.output:
+        document = {
+            'commit': _commit(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'arguments': vars(args),
+            'environment': {k: v for k, v in os.environ.items() if k.startswith('BUGIS_')},
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Microbenchmark of the per request cost of bugis.asgi.application on its cheapest paths.
+
+    python benchmark/static.py --output results.json [--baseline previous.json]
+
+Static resources, with and without compression, and 304 responses to conditional requests for
+static resources and Markdown documents are requested over and over with the headers a browser
+sends, by a client that does nothing with the response. The time per request is almost entirely
+spent dispatching the request and building the response.
+"""
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Optional
+
+from run import _commit
+
+_BROWSER_HEADERS = [
+    (b'host', b'localhost:8000'),
+    (b'user-agent', b'Mozilla/5.0 (X11; Linux x86_64; rv:131.0) Gecko/20100101 Firefox/131.0'),
+    (b'accept', b'text/css,*/*;q=0.1'),
+    (b'accept-language', b'en-US,en;q=0.5'),
+    (b'accept-encoding', b'gzip, deflate, br, zstd'),
+    (b'connection', b'keep-alive'),
+    (b'referer', b'http://localhost:8000/README.md'),
+    (b'sec-fetch-dest', b'style'),
+    (b'sec-fetch-mode', b'no-cors'),
+    (b'sec-fetch-site', b'same-origin'),
+]
+
+
+def _scope(path: str, headers: list[tuple[bytes, bytes]]) -> dict[str, Any]:
+    return {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': b'',
+        'headers': headers,
+    }
+
+
+async def _etag(application, path: str) -> bytes:
+    etag = b''
+
+    async def send(message: dict) -> None:
+        nonlocal etag
+        if message['type'] == 'http.response.start':
+            etag = dict(message.get('headers', ())).get(b'Etag', b'')
+
+    await application(_scope(path, _BROWSER_HEADERS), _receive, send)
+    return etag
+
+
+async def _receive() -> dict:
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+async def measure(application, scope: dict[str, Any], requests: int) -> dict[str, Any]:
+    statuses = set()
+
+    async def send(message: dict) -> None:
+        if message['type'] == 'http.response.start':
+            statuses.add(message['status'])
+
+    for _ in range(min(100, requests)):
+        await application(scope, _receive, send)
+    start = perf_counter()
+    for _ in range(requests):
+        await application(scope, _receive, send)
+    elapsed = perf_counter() - start
+    return {
+        'requests': requests,
+        'statuses': sorted(statuses),
+        'us_per_request': elapsed / requests * 1e6,
+    }
+
+
+async def run(requests: int) -> dict[str, dict[str, Any]]:
+    from bugis import asgi
+    application = asgi.application
+    css_etag = await _etag(application, '/github-markdown.css')
+    md_etag = await _etag(application, '/README.md')
+    identity = [it for it in _BROWSER_HEADERS if it[0] != b'accept-encoding']
+    scenarios = {
+        'static/identity': _scope('/github-markdown.css', identity),
+        'static/compressed': _scope('/github-markdown.css', _BROWSER_HEADERS),
+        'static/not_modified': _scope('/github-markdown.css', _BROWSER_HEADERS + [(b'if-none-match', css_etag)]),
+        'markdown/not_modified': _scope('/README.md', _BROWSER_HEADERS + [(b'if-none-match', md_etag)]),
+    }
+    try:
+        return {name: await measure(application, scope, requests) for name, scope in scenarios.items()}
+    finally:
+        await asgi._server.stop()
+
+
+def _report(results: dict[str, dict[str, Any]], baseline: Optional[dict[str, dict[str, Any]]]) -> None:
+    for name, result in results.items():
+        line = f'{name:<24}{result["us_per_request"]:>10.2f} us/request {result["statuses"]}'
+        previous = (baseline or {}).get(name)
+        if previous:
+            line += f'{previous["us_per_request"] / result["us_per_request"]:>8.2f}x faster than baseline'
+        print(line)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='file the JSON results are written to')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--requests', type=int, default=20000, help='requests per scenario')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, 'README.md'), 'w') as f:
+            f.write('# Benchmark\n\nA document that is only ever revalidated.\n')
+        # The server serves its working directory, the access log would measure the logging configuration
+        os.chdir(root)
+        os.environ.setdefault('BUGIS_WARM_UP', 'false')
+        logging.disable(logging.INFO)
+        results = asyncio.run(run(args.requests))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    _report(results, baseline)
+    if args.output:
+        document = {
+            'commit': _commit(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'arguments': vars(args),
+            'environment': {k: v for k, v in os.environ.items() if k.startswith('BUGIS_')},
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
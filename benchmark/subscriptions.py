@@ -0,0 +1,192 @@
+"""Benchmark of the hot reload subscriber bookkeeping, bugis.async_watchdog.SubscriptionManager.
+
+    python benchmark/subscriptions.py --subscribers 10000 --output results.json [--baseline previous.json]
+
+Every subscriber is a task long polling a single document, like a browser tab left open on it.
+The benchmark measures the memory each waiting subscriber costs, the time from the notification of
+a change to the last subscriber resuming, and the rate at which the long polls are set up and torn
+down again. It only uses the public interface of the manager, so that it can be run unchanged against
+previous commits.
+"""
+import asyncio
+import gc
+import json
+import os
+import platform
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Optional
+
+from bugis.async_watchdog import SubscriptionManager
+from run import _commit
+
+_PATH = '/wallboard.md'
+_TIMEOUT = 30
+
+
+def _percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def _settle() -> None:
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+async def memory(subscribers: int) -> dict[str, Any]:
+    """Bytes allocated per waiting subscriber, the task that waits included"""
+    loop = asyncio.get_running_loop()
+    manager = SubscriptionManager(loop, debounce=0)
+
+    async def poll() -> None:
+        subscription = manager.subscribe(_PATH)
+        try:
+            await subscription.wait(_TIMEOUT)
+        finally:
+            subscription.unsubscribe()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.ensure_future(poll()) for _ in range(subscribers)]
+    await _settle()
+    polling_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    manager.post_event(_PATH)
+    await asyncio.gather(*tasks)
+    return {
+        'subscribers': subscribers,
+        'bytes_per_subscriber': polling_bytes / subscribers,
+    }
+
+
+async def fan_out(subscribers: int, rounds: int) -> dict[str, Any]:
+    """Time from the notification of a change until every subscriber resumed"""
+    loop = asyncio.get_running_loop()
+    manager = SubscriptionManager(loop, debounce=0)
+    latencies: list[float] = []
+    for _ in range(rounds):
+        resumed = 0
+        last = 0.0
+
+        async def poll() -> None:
+            nonlocal resumed, last
+            subscription = manager.subscribe(_PATH)
+            try:
+                await subscription.wait(_TIMEOUT)
+            finally:
+                subscription.unsubscribe()
+            resumed += 1
+            last = perf_counter()
+
+        tasks = [asyncio.ensure_future(poll()) for _ in range(subscribers)]
+        await _settle()
+        start = perf_counter()
+        manager.post_event(_PATH)
+        await asyncio.gather(*tasks)
+        assert resumed == subscribers
+        latencies.append(last - start)
+    return {
+        'subscribers': subscribers,
+        'rounds': rounds,
+        'p50': _percentile(latencies, 0.5),
+        'max': max(latencies),
+    }
+
+
+async def churn(subscribers: int, rounds: int) -> dict[str, Any]:
+    """Long polls set up and torn down per second, with subscribers coming back after every change"""
+    loop = asyncio.get_running_loop()
+    manager = SubscriptionManager(loop, debounce=0)
+    remaining = rounds
+    changed = asyncio.Event()
+    waiting = 0
+
+    async def poll() -> None:
+        nonlocal waiting
+        while remaining:
+            subscription = manager.subscribe(_PATH)
+            waiting += 1
+            if waiting == subscribers:
+                changed.set()
+            try:
+                await subscription.wait(_TIMEOUT)
+            finally:
+                subscription.unsubscribe()
+
+    tasks = [asyncio.ensure_future(poll()) for _ in range(subscribers)]
+    start = perf_counter()
+    while remaining:
+        await changed.wait()
+        changed.clear()
+        waiting = 0
+        remaining -= 1
+        manager.post_event(_PATH)
+        await _settle()
+    await asyncio.gather(*tasks)
+    elapsed = perf_counter() - start
+    return {
+        'subscribers': subscribers,
+        'rounds': rounds,
+        'polls_per_second': subscribers * rounds / elapsed,
+    }
+
+
+async def run(subscribers: int, rounds: int) -> dict[str, dict[str, Any]]:
+    return {
+        'memory': await memory(subscribers),
+        'fan_out': await fan_out(subscribers, rounds),
+        'churn': await churn(subscribers, rounds),
+    }
+
+
+def _report(results: dict[str, dict[str, Any]], baseline: Optional[dict[str, dict[str, Any]]]) -> None:
+    metrics = (
+        ('memory', 'bytes_per_subscriber', 'B'),
+        ('fan_out', 'p50', 's'),
+        ('fan_out', 'max', 's'),
+        ('churn', 'polls_per_second', '/s'),
+    )
+    for scenario, metric, unit in metrics:
+        value = results[scenario][metric]
+        line = f'{scenario + "/" + metric:<32}{value:>14.6g} {unit:<3}'
+        previous = (baseline or {}).get(scenario, {}).get(metric)
+        if previous:
+            line += f'{value / previous:>8.2f}x baseline'
+        print(line)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='file the JSON results are written to')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--subscribers', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.subscribers, args.rounds))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    _report(results, baseline)
+    if args.output:
+        document = {
+            'commit': _commit(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'arguments': vars(args),
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
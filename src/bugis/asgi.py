@@ -1,11 +1,17 @@
 import logging
 from logging.config import dictConfig as configure_logging
-from os import environ
+from os import environ, cpu_count
 from pathlib import Path
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional
 
-from pwo import Maybe
 from yaml import safe_load
 from .server import Server
+from .executor import Executors
+from .md2html import render_version
+from .render_store import DiskRenderStore
+from .graphviz import GraphRenderer
+from .metrics import Metrics, Send
 
 logging_configuration_file = environ.get("LOGGING_CONFIGURATION_FILE", Path(__file__).parent / 'default-conf' / 'logging.yaml')
 with open(logging_configuration_file, 'r') as input_file:
@@ -15,21 +21,141 @@ with open(logging_configuration_file, 'r') as input_file:
 
 log = logging.getLogger(__name__)
 
-_server = None
-async def application(ctx, receive, send):
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+
+_started = monotonic()
+_server: Optional[Server] = None
+_first_request = True
+
+
+def request_headers(ctx: dict[str, Any]) -> tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
+    """If-None-Match, Range, If-Range and Accept-Encoding, the first of each, in a single pass"""
+    if_none_match = range_header = if_range = accept_encoding = None
+    # ASGI servers send header names lowercased
+    for name, value in ctx['headers']:
+        if name == b'if-none-match':
+            if if_none_match is None:
+                if_none_match = value.decode('latin-1')
+        elif name == b'accept-encoding':
+            if accept_encoding is None:
+                accept_encoding = value.decode('latin-1')
+        elif name == b'range':
+            if range_header is None:
+                range_header = value.decode('latin-1')
+        elif name == b'if-range':
+            if if_range is None:
+                if_range = value.decode('latin-1')
+    return if_none_match, range_header, if_range, accept_encoding
+
+
+def _flag(name: str, default: str) -> bool:
+    return environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+def create_server() -> Server:
+    render_store_dir = environ.get("BUGIS_RENDER_STORE")
+    render_workers = int(environ.get("BUGIS_RENDER_WORKERS", min(4, cpu_count() or 1)))
+    max_pending = int(environ.get("BUGIS_MAX_PENDING_JOBS", 64))
+    metrics_path = environ.get("BUGIS_METRICS_PATH") or None
+    server_timing = _flag("BUGIS_SERVER_TIMING", 'false')
+    return Server(
+        prefix=None,
+        render_cache_size=int(environ.get("BUGIS_RENDER_CACHE_SIZE", 64 * 1024 * 1024)),
+        executors=Executors(
+            io_threads=int(environ.get("BUGIS_IO_THREADS", 8)),
+            render_workers=render_workers,
+            render_executor=environ.get("BUGIS_RENDER_EXECUTOR", 'process'),
+            max_pending=max_pending,
+        ),
+        validator=environ.get("BUGIS_VALIDATOR", 'content'),
+        background_hash=_flag("BUGIS_BACKGROUND_HASH", 'false'),
+        render_store=render_store_dir and DiskRenderStore(
+            render_store_dir,
+            max_size=int(environ.get("BUGIS_RENDER_STORE_SIZE", 256 * 1024 * 1024)),
+            namespace=render_version()
+        ) or None,
+        graph_renderer=GraphRenderer(
+            max_jobs=int(environ.get("BUGIS_GRAPHVIZ_JOBS", render_workers)),
+            max_pending=max_pending,
+            timeout=float(environ.get("BUGIS_GRAPHVIZ_TIMEOUT", 10)),
+            memory_limit=int(environ.get("BUGIS_GRAPHVIZ_MEMORY_LIMIT", 512 * 1024 * 1024)) or None
+        ),
+        watch_debounce=float(environ.get("BUGIS_WATCH_DEBOUNCE", 0.1)),
+        watch_socket=environ.get("BUGIS_WATCH_SOCKET"),
+        metrics=(metrics_path or server_timing) and Metrics(server_timing) or None,
+        metrics_path=metrics_path,
+        stream_threshold=int(environ.get("BUGIS_STREAM_THRESHOLD", 8 * 1024 * 1024)),
+        search=_flag("BUGIS_SEARCH", 'false'),
+        stat_cache_ttl=float(environ.get("BUGIS_STAT_CACHE_TTL", 1)),
+        listing_cache_size=int(environ.get("BUGIS_LISTING_CACHE_SIZE", 1024 * 1024))
+    )
+
+
+async def start_server() -> None:
     global _server
+    _server = create_server()
+    if _flag("BUGIS_WARM_UP", 'true'):
+        documents = [it.strip() for it in environ.get("BUGIS_WARM_UP_DOCUMENTS", '').split(',') if it.strip()]
+        await _server.warm_up(documents)
+    log.info('Ready to serve requests %.3fs after startup', monotonic() - _started)
+
+
+async def lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await start_server()
+            except Exception as e:
+                log.exception('Startup failed')
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _server is not None:
+                await _server.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def log_first_byte(send: Send, received: float) -> Send:
+    started = False
+
+    async def wrapper(message: dict[str, Any]) -> None:
+        nonlocal started
+        if not started and message['type'] == 'http.response.start':
+            started = True
+            now = monotonic()
+            log.info('First response started %.3fs after its request, %.3fs after startup',
+                     now - received, now - _started)
+        await send(message)
+
+    return wrapper
+
+
+async def application(ctx: dict[str, Any], receive: Receive, send: Send) -> None:
+    global _server, _first_request
+    if ctx['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if _first_request:
+        _first_request = False
+        send = log_first_byte(send, monotonic())
     if _server is None:
-        _server = Server(prefix=None)
+        # Without lifespan support the server is built by the first request
+        _server = create_server()
     log.info(None, extra=ctx)
+    if_none_match, range_header, if_range, accept_encoding = request_headers(ctx)
+    query_string = ctx.get('query_string')
     await _server.handle_request(
         ctx['method'],
         ctx['path'],
-        Maybe.of([header[1] for header in ctx['headers'] if header[0].decode().lower() == 'if-none-match'])
-            .filter(lambda it: len(it) > 0)
-            .map(lambda it: it[0])
-            .map(lambda it: it.decode())
-            .or_else(None),
-        Maybe.of_nullable(ctx.get('query_string', None)).map(lambda it: it.decode()).or_else(None),
-        send
+        if_none_match,
+        query_string.decode() if query_string is not None else None,
+        send,
+        range_header=range_header,
+        if_range=if_range,
+        extensions=ctx.get('extensions'),
+        accept_encoding=accept_encoding,
+        receive=receive
     )
-
@@ -1,42 +1,161 @@
 import asyncio
+import math
 
 from watchdog.events import FileSystemEventHandler, FileSystemEvent, PatternMatchingEventHandler
 from watchdog.observers import Observer
-from watchdog.events import FileMovedEvent, FileClosedEvent, FileCreatedEvent, FileModifiedEvent
+from watchdog.events import FileMovedEvent, FileClosedEvent, FileCreatedEvent, FileModifiedEvent, \
+    FileDeletedEvent, DirCreatedEvent, DirDeletedEvent, DirMovedEvent
+from os.path import dirname
 from pathlib import Path
-from asyncio import Queue, AbstractEventLoop, Future, CancelledError, Task
+from threading import Lock
+from asyncio import Queue, AbstractEventLoop, Future, TimerHandle
 from typing import Optional, Callable
 from logging import getLogger
 
 
-class Subscription:
-    _unsubscribe_callback: Callable[['Subscription'], None]
-    _event: Future
-    _loop: AbstractEventLoop
+class _Broadcast(Future):
+    """Future shared by every subscriber to a path whose wait ends in the same slot of the timer wheel.
+
+    It resolves to False when the slot expires and to True when the waiters have to check whether
+    the notification is for them. Cancelling the task of one waiter must not cancel the others, so
+    cancel() only wakes them all up: the cancelled task still gets CancelledError once it resumes,
+    the others find out that nothing happened to them and wait again.
+    """
+
+    def wake(self) -> None:
+        if not self.done():
+            self.set_result(True)
+
+    def cancel(self, msg=None) -> bool:
+        self.wake()
+        return False
+
+
+class _Channel:
+    """Subscribers to a path: their number, the version bumped by every change and the pending waits by slot"""
+    __slots__ = ('subscribers', 'version', 'waits')
+    subscribers: int
+    version: int
+    waits: dict[int, _Broadcast]
 
-    def __init__(self, unsubscribe: Callable[['Subscription'], None], loop: AbstractEventLoop):
-        self._unsubscribe_callback = unsubscribe
-        self._event: Future = loop.create_future()
+    def __init__(self):
+        self.subscribers = 0
+        self.version = 0
+        self.waits = dict()
+
+
+class TimerWheel:
+    """Expire the waits of all the subscriptions with a single loop timer.
+
+    Deadlines are rounded up to a multiple of resolution, every wait for the same path that ends
+    in the same slot shares a single future and all of a slot is expired by the same tick.
+    """
+    __slots__ = ('_loop', '_resolution', '_slots', '_expired', '_next', '_timer')
+    _loop: AbstractEventLoop
+    _resolution: float
+    _slots: dict[int, set[_Channel]]
+    # Last slot expired and slot the timer is set for
+    _expired: int
+    _next: Optional[int]
+    _timer: Optional[TimerHandle]
+
+    def __init__(self, loop: AbstractEventLoop, resolution: float = 0.5):
         self._loop = loop
+        self._resolution = resolution
+        self._slots = dict()
+        self._expired = int(loop.time() // resolution)
+        self._next = None
+        self._timer = None
+
+    def slot(self, timeout: float) -> int:
+        return math.ceil((self._loop.time() + timeout) / self._resolution)
+
+    def future(self, channel: _Channel, slot: int) -> Optional[_Broadcast]:
+        """Future shared by the waits for channel ending in slot, None if slot is already expired"""
+        if slot <= self._expired:
+            return None
+        future = channel.waits.get(slot)
+        if future is None or future.done():
+            future = channel.waits[slot] = _Broadcast(loop=self._loop)
+            channels = self._slots.get(slot)
+            if channels is None:
+                channels = self._slots[slot] = set()
+                if self._next is None or slot < self._next:
+                    self._schedule(slot)
+            channels.add(channel)
+        return future
+
+    def _schedule(self, slot: int) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._next = slot
+        self._timer = self._loop.call_at(slot * self._resolution, self._tick)
+
+    def _tick(self) -> None:
+        # The loop runs timers up to its clock resolution early
+        self._expired = max(self._next or 0, int(self._loop.time() // self._resolution))
+        self._next = self._timer = None
+        for slot in [it for it in self._slots if it <= self._expired]:
+            for channel in self._slots.pop(slot):
+                future = channel.waits.pop(slot, None)
+                if future is not None and not future.done():
+                    future.set_result(False)
+        if self._slots:
+            self._schedule(min(self._slots))
+
+
+class Subscription:
+    __slots__ = ('_manager', '_path', '_channel', '_version', '_interrupted', '_waiting')
+    _manager: Optional['SubscriptionManager']
+    _path: str
+    _channel: _Channel
+    # Version of the channel last seen, the subscription is notified as soon as it changes
+    _version: int
+    _interrupted: bool
+    _waiting: Optional[_Broadcast]
+
+    def __init__(self, manager: 'SubscriptionManager', path: str, channel: _Channel):
+        self._manager = manager
+        self._path = path
+        self._channel = channel
+        self._version = channel.version
+        self._interrupted = False
+        self._waiting = None
 
     def unsubscribe(self) -> None:
-        self._unsubscribe_callback(self)
+        if self._manager is not None:
+            self._manager._unsubscribe(self._path, self._channel)
+            self._manager = None
 
     async def wait(self, tout: float) -> bool:
-        handle = self._loop.call_later(tout, lambda: self._event.cancel())
-        try:
-            await self._event
-            return True
-        except CancelledError:
+        manager = self._manager
+        if manager is None:
             return False
-        finally:
-            handle.cancel()
+        wheel = manager._wheel
+        slot = wheel.slot(tout)
+        channel = self._channel
+        while not self._interrupted and self._version == channel.version:
+            future = wheel.future(channel, slot)
+            if future is None:
+                return False
+            self._waiting = future
+            try:
+                if not await future:
+                    return False
+            finally:
+                self._waiting = None
+        return True
 
     def notify(self) -> None:
-        self._event.set_result(None)
+        """Wake up this subscription alone"""
+        self._interrupted = True
+        if self._waiting is not None:
+            self._waiting.wake()
 
     def reset(self) -> None:
-        self._event = self._loop.create_future()
+        """Consume the notification received so far, if any"""
+        self._version = self._channel.version
+        self._interrupted = False
 
 
 class _EventHandler(FileSystemEventHandler):
@@ -87,70 +206,133 @@ def watch(path: Path, queue: Queue, loop: AbstractEventLoop,
 
 
 class SubscriptionManager:
-    _loop: AbstractEventLoop
-    _queue: Queue
-    _subscriptions: dict[str, set[Subscription]]
+    """Deliver filesystem events posted from the watchdog threads to the subscriptions on the event loop.
 
-    def __init__(self, loop: AbstractEventLoop):
-        self._subscriptions: dict[str, set[Subscription]] = dict()
+    Events are coalesced per path: the first one schedules a flush debounce seconds later,
+    the following ones until then are merged with it, so that a storm of events costs
+    a single loop wakeup and every subscription is notified at most once per window.
+
+    The subscribers to a path share its channel, a change bumps the channel version and resolves
+    the few futures the subscribers wait on, rather than one future per subscriber.
+    """
+    _loop: AbstractEventLoop
+    _channels: dict[str, _Channel]
+    _wheel: TimerWheel
+    _listeners: list[Callable[[str], None]]
+    _forwarders: list[Callable[[str], None]]
+    _watch: Optional[Callable[[str, bool], None]]
+    _debounce: float
+    _lock: Lock
+    _changed: set[str]
+    _directories: set[str]
+    _scheduled: bool
+
+    def __init__(self,
+                 loop: AbstractEventLoop,
+                 debounce: float = 0.1,
+                 watch: Optional[Callable[[str, bool], None]] = None):
+        """watch is called with (path, True) when path gets its first subscription
+        and with (path, False) when its last one goes away"""
+        self._channels = dict()
+        self._wheel = TimerWheel(loop)
+        self._listeners = []
+        self._forwarders = []
+        self._watch = watch
         self._loop = loop
-        self._queue = Queue()
+        self._debounce = debounce
+        self._lock = Lock()
+        self._changed = set()
+        self._directories = set()
+        self._scheduled = False
 
     def subscribe(self, path: str) -> Subscription:
-        subscriptions = self._subscriptions
-        subscriptions_per_path = subscriptions.setdefault(path, set())
+        channel = self._channels.get(path)
+        if channel is None:
+            channel = self._channels[path] = _Channel()
+            if self._watch:
+                self._watch(path, True)
+        channel.subscribers += 1
+        return Subscription(self, path, channel)
 
-        def unsubscribe_callback(subscription):
-            subscriptions_per_path.remove(subscription)
+    def _unsubscribe(self, path: str, channel: _Channel) -> None:
+        channel.subscribers -= 1
+        if not channel.subscribers and self._channels.get(path) is channel:
+            del self._channels[path]
+            if self._watch:
+                self._watch(path, False)
 
-        result = Subscription(unsubscribe_callback, self._loop)
-        subscriptions_per_path.add(result)
-        return result
+    def paths(self) -> list[str]:
+        return list(self._channels)
 
-    def _notify_subscriptions(self, path):
-        subscriptions = self._subscriptions
-        subscriptions_per_path = subscriptions.get(path, None)
-        if subscriptions_per_path:
-            for s in subscriptions_per_path:
-                s.notify()
+    def subscribed(self, path: str) -> bool:
+        return path in self._channels
 
-    async def process_events(self):
-        async for evt in AsyncQueueIterator(self._queue):
-            self._notify_subscriptions(evt)
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        self._listeners.append(listener)
 
-    def post_event(self, path):
-        self._loop.call_soon_threadsafe(self._queue.put_nowait, path)
+    def remove_listener(self, listener: Callable[[str], None]) -> None:
+        self._listeners.remove(listener)
 
+    def add_forwarder(self, forwarder: Callable[[str], None]) -> None:
+        """Call forwarder on the event loop with every changed path, subscribed to or not"""
+        self._forwarders.append(forwarder)
 
-class FileWatcher(PatternMatchingEventHandler):
+    def _notify_subscriptions(self, path):
+        channel = self._channels.get(path)
+        if channel is not None:
+            channel.version += 1
+            waits, channel.waits = channel.waits, dict()
+            for future in waits.values():
+                future.wake()
+
+    def _flush(self) -> None:
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            directories, self._directories = self._directories, set()
+            self._scheduled = False
+        for path in changed:
+            self._notify_subscriptions(path)
+            for forwarder in self._forwarders:
+                forwarder(path)
+        for directory in directories:
+            for listener in self._listeners:
+                listener(directory)
+
+    def _schedule(self) -> None:
+        # Called with the lock held
+        if not self._scheduled:
+            self._scheduled = True
+            self._loop.call_soon_threadsafe(self._loop.call_later, self._debounce, self._flush)
+
+    def post_event(self, path: str) -> None:
+        """Notify the subscriptions to path, can be called from any thread"""
+        with self._lock:
+            self._changed.add(path)
+            self._schedule()
+
+    def post_directory_event(self, directory: str) -> None:
+        """Notify the listeners that the entries of directory changed, can be called from any thread"""
+        with self._lock:
+            self._directories.add(directory)
+            self._schedule()
+
+
+class SubscriptionEventHandler(PatternMatchingEventHandler):
+    """Post the watchdog events to a SubscriptionManager"""
     _subscription_manager: SubscriptionManager
-    _loop: AbstractEventLoop
-    _subscription_manager_loop: Task
 
-    def __init__(self, path):
-        super().__init__(patterns=['*.md'],
+    def __init__(self, subscription_manager: SubscriptionManager):
+        # Every file is watched so that listeners learn about directory entries being added or removed
+        # and forwarders about any change, subscriptions are only ever made to Markdown documents
+        super().__init__(patterns=None,
                          ignore_patterns=None,
                          ignore_directories=False,
                          case_sensitive=True)
-        self._observer: Observer = Observer()
-        self._observer.schedule(self, path=path, recursive=True)
-        self.logger = getLogger(FileWatcher.__name__)
-        self._loop = asyncio.get_running_loop()
-        self._subscription_manager = SubscriptionManager(self._loop)
-        self._loop.run_in_executor(None, self._observer.start)
-        self._subscription_manager_loop = self._loop.create_task(self._subscription_manager.process_events())
-
-    async def stop(self) -> None:
-        def _observer_stop():
-            self._observer.stop()
-            self._observer.join()
-            self._subscription_manager.post_event(None)
+        self._subscription_manager = subscription_manager
+        self.logger = getLogger(type(self).__name__)
 
-        self._loop.run_in_executor(None, _observer_stop)
-        await self._subscription_manager_loop
-
-    def subscribe(self, path: str) -> Subscription:
-        return self._subscription_manager.subscribe(path)
+    def _directory_changed(self, path: str) -> None:
+        self._subscription_manager.post_directory_event(dirname(path))
 
     def on_any_event(self, event: FileSystemEvent) -> None:
         what = "directory" if event.is_directory else "file"
@@ -158,11 +340,18 @@ class FileWatcher(PatternMatchingEventHandler):
         def post_event(path):
             self._subscription_manager.post_event(path)
 
+        if isinstance(event, (FileCreatedEvent, FileDeletedEvent, DirCreatedEvent, DirDeletedEvent)):
+            self._directory_changed(event.src_path)
+        elif isinstance(event, (FileMovedEvent, DirMovedEvent)):
+            self._directory_changed(event.src_path)
+            self._directory_changed(event.dest_path)
+
         if isinstance(event, FileClosedEvent):
             self.logger.debug("Closed %s: %s", what, event.src_path)
             # update_subscriptions()
         elif isinstance(event, FileMovedEvent):
             self.logger.debug("Moved %s: %s to %s", what, event.src_path, event.dest_path)
+            post_event(event.src_path)
             post_event(event.dest_path)
         elif isinstance(event, FileCreatedEvent):
             self.logger.debug("Created %s: %s", what, event.src_path)
@@ -170,3 +359,39 @@ class FileWatcher(PatternMatchingEventHandler):
         elif isinstance(event, FileModifiedEvent):
             self.logger.debug("Modified %s: %s", what, event.src_path)
             post_event(event.src_path)
+        elif isinstance(event, FileDeletedEvent):
+            self.logger.debug("Deleted %s: %s", what, event.src_path)
+            post_event(event.src_path)
+
+
+class FileWatcher(SubscriptionEventHandler):
+    _loop: AbstractEventLoop
+
+    def __init__(self, path, debounce: float = 0.1):
+        self._loop = asyncio.get_running_loop()
+        super().__init__(SubscriptionManager(self._loop, debounce))
+        self._observer: Observer = Observer()
+        self._observer.schedule(self, path=path, recursive=True)
+        self._loop.run_in_executor(None, self._observer.start)
+
+    async def stop(self) -> None:
+        def _observer_stop():
+            self._observer.stop()
+            self._observer.join()
+
+        await self._loop.run_in_executor(None, _observer_stop)
+
+    def subscribe(self, path: str) -> Subscription:
+        return self._subscription_manager.subscribe(path)
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """Call listener on the event loop with the path of every directory whose entries change"""
+        self._subscription_manager.add_listener(listener)
+
+    def add_forwarder(self, forwarder: Callable[[str], None]) -> None:
+        """Call forwarder on the event loop with every file that changes below the watched path"""
+        self._subscription_manager.add_forwarder(forwarder)
+
+    def add_observer(self, observer: Callable[[str], None]) -> None:
+        """Same as add_forwarder, this watcher is notified about every change below the watched path anyway"""
+        self._subscription_manager.add_forwarder(observer)
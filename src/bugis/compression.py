@@ -0,0 +1,87 @@
+import gzip
+from functools import lru_cache
+from typing import Callable, Optional, Iterable
+
+# Bodies smaller than this are not worth the CPU time nor the Content-Encoding header
+MIN_COMPRESSION_SIZE = 1024
+
+Encoder = Callable[[bytes, bool], bytes]
+
+
+def _gzip(data: bytes, best: bool) -> bytes:
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+# Ordered by server preference, used to break ties between equally acceptable codings
+ENCODERS: dict[str, Encoder] = {}
+
+try:
+    import brotli
+
+    def _brotli(data: bytes, best: bool) -> bytes:
+        compressed: bytes = brotli.compress(data, quality=11 if best else 5, mode=brotli.MODE_TEXT)
+        return compressed
+
+    ENCODERS['br'] = _brotli
+except ImportError:
+    pass
+
+try:
+    import zstandard
+
+    def _zstd(data: bytes, best: bool) -> bytes:
+        compressed: bytes = zstandard.ZstdCompressor(level=19 if best else 3).compress(data)
+        return compressed
+
+    ENCODERS['zstd'] = _zstd
+except ImportError:
+    pass
+
+ENCODERS['gzip'] = _gzip
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    return ENCODERS[encoding](data, best)
+
+
+def parse_accept_encoding(header: Optional[str]) -> dict[str, float]:
+    result: dict[str, float] = {}
+    if not header:
+        return result
+    for item in header.split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[coding] = q
+    return result
+
+
+def negotiate(accept_encoding: Optional[str], available: Iterable[str] = ENCODERS) -> Optional[str]:
+    """Pick the content coding to use, None means identity"""
+    accepted = parse_accept_encoding(accept_encoding)
+    if not accepted:
+        return None
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in available:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    if best is not None and accepted.get('identity', 0.0) > best_q:
+        return None
+    return best
+
+
+@lru_cache(maxsize=1024)
+def preferred_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """negotiate() among all the encoders, memoized since clients send very few distinct headers"""
+    return negotiate(accept_encoding)
@@ -0,0 +1,80 @@
+from hashlib import sha1
+from html import escape
+from shutil import which
+from typing import Any
+
+from markdown import Markdown
+from markdown.extensions import Extension
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from markdown.preprocessors import Preprocessor
+
+from .graphviz import render_graph, GraphvizError
+from .render_cache import RenderCache
+
+# Rendered diagrams by hash of their source, editing the text around a diagram never lays it out again
+DIAGRAM_CACHE = RenderCache[str](16 * 1024 * 1024)
+
+
+def _inline_svg(svg: bytes) -> str:
+    # Drop the XML declaration and doctype that precede the svg element
+    text = svg.decode()
+    start = text.find('<svg')
+    return text[start:] if start >= 0 else text
+
+
+class DotFencePreprocessor(Preprocessor):
+    """Replace ```dot fenced code blocks with the SVG rendering of the graph"""
+
+    def __init__(self, md: Markdown, config: dict[str, Any]):
+        super().__init__(md)
+        self.timeout = config['timeout']
+        self.memory_limit = config['memory_limit']
+
+    def diagram(self, source: str) -> str:
+        key = sha1(source.encode()).hexdigest()
+        html = DIAGRAM_CACHE.get(key)
+        if html is None:
+            try:
+                svg = render_graph(source.encode(), timeout=self.timeout, memory_limit=self.memory_limit)
+                html = f'<div class="graphviz">{_inline_svg(svg)}</div>'
+            except GraphvizError as e:
+                return f'<pre class="graphviz-error">{escape(str(e))}</pre>'
+            DIAGRAM_CACHE.put(key, html)
+        return html
+
+    def run(self, lines: list[str]) -> list[str]:
+        text = '\n'.join(lines)
+        result = []
+        index = 0
+        for m in FencedBlockPreprocessor.FENCED_BLOCK_RE.finditer(text):
+            if m.group('lang') != 'dot':
+                continue
+            placeholder = self.md.htmlStash.store(self.diagram(m.group('code')))
+            result.append(text[index:m.start()])
+            result.append(f'\n{placeholder}\n')
+            index = m.end()
+        if not result:
+            return lines
+        result.append(text[index:])
+        return ''.join(result).split('\n')
+
+
+class DotFenceExtension(Extension):
+
+    def __init__(self, **kwargs: Any):
+        self.config = {
+            'timeout': [10, 'Seconds after which a Graphviz process is killed'],
+            'memory_limit': [512 * 1024 * 1024, 'Address space limit in bytes of every Graphviz process'],
+        }
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md: Markdown) -> None:
+        if which('dot') is None:
+            # Without Graphviz the blocks are left to fenced_code and shown as source
+            return
+        # Before fenced_code, which is registered with priority 25
+        md.preprocessors.register(DotFencePreprocessor(md, self.getConfigs()), 'dot_fence', 27)
+
+
+def makeExtension(**kwargs: Any) -> DotFenceExtension:
+    return DotFenceExtension(**kwargs)
@@ -0,0 +1,61 @@
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Sequence, TypeVar
+
+import markdown
+from markdown.extensions import codehilite
+
+T = TypeVar('T')
+
+_local = threading.local()
+
+
+def _engines() -> dict[tuple[str, ...], markdown.Markdown]:
+    engines = getattr(_local, 'engines', None)
+    if engines is None:
+        engines = _local.engines = dict()
+    return engines
+
+
+@contextmanager
+def markdown_engine(extensions: Sequence[str]) -> Iterator[markdown.Markdown]:
+    """Borrow this thread's Markdown instance for the given extensions, already reset.
+
+    Building a Markdown instance loads all of its extensions, so every thread keeps one
+    per extension configuration; a nested use on the same thread gets a private instance.
+    """
+    key = tuple(extensions)
+    engines = _engines()
+    engine = engines.pop(key, None)
+    if engine is None:
+        engine = markdown.Markdown(extensions=list(extensions), output_format='html')
+    try:
+        yield engine.reset()
+    finally:
+        engines[key] = engine
+
+
+def _cached_factory(name: str, factory: Callable[..., T]) -> Callable[..., T]:
+    def get(alias: str, **options: Any) -> T:
+        try:
+            key = (alias, tuple(sorted(options.items())))
+            hash(key)
+        except TypeError:
+            return factory(alias, **options)
+        cache = getattr(_local, name, None)
+        if cache is None:
+            cache = dict()
+            setattr(_local, name, cache)
+        result = cache.get(key)
+        if result is None:
+            result = cache[key] = factory(alias, **options)
+        return result
+
+    return get
+
+
+if codehilite.pygments:
+    # codehilite resolves a Pygments lexer and formatter for every code block, looking them up
+    # among all the registered plugins each time: resolve each configuration only once per thread
+    codehilite.get_lexer_by_name = _cached_factory('lexers', codehilite.get_lexer_by_name)
+    codehilite.get_formatter_by_name = _cached_factory('formatters', codehilite.get_formatter_by_name)
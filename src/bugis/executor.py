@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from asyncio import AbstractEventLoop
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from os import cpu_count
+from threading import Lock
+from typing import Callable, TypeVar, Any, Optional
+
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorSaturated(Exception):
+    pass
+
+
+class BoundedExecutor:
+    _executor: Executor
+    _factory: Optional[Callable[[], Executor]]
+    _lock: Lock
+    _max_pending: int
+    _pending: int
+
+    def __init__(self, executor: Executor, max_pending: int, factory: Optional[Callable[[], Executor]] = None):
+        """factory builds the replacement of a process pool that a dying worker left broken"""
+        if max_pending <= 0:
+            raise ValueError("Maximum number of pending jobs must be greater than 0")
+        self._executor = executor
+        self._factory = factory
+        self._lock = Lock()
+        self._max_pending = max_pending
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _release(self) -> None:
+        self._pending -= 1
+
+    async def submit(self, fn: Callable[..., T], *args: Any) -> T:
+        if self._pending >= self._max_pending:
+            raise ExecutorSaturated()
+        return await self.submit_unbounded(fn, *args)
+
+    async def submit_unbounded(self, fn: Callable[..., T], *args: Any) -> T:
+        # Meant for follow-up jobs of a request that has already been accepted
+        loop: AbstractEventLoop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            if self._factory is None:
+                raise
+            # The pool broke while idle, the job never ran and can go to its replacement
+            self._replace(executor)
+            future = self._executor.submit(fn, *args)
+        self._pending += 1
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            # A worker died and took the pool along with every job it had, these fail rather than
+            # being retried, as the job that killed the worker would kill the next pool too
+            if self._factory is not None:
+                self._replace(executor)
+            raise
+
+    def _replace(self, broken: Executor) -> None:
+        assert self._factory is not None
+        with self._lock:
+            # Every job of the broken pool fails at once, only the first one to get here replaces it
+            if self._executor is broken:
+                logger.warning('A worker process terminated abruptly, replacing the process pool')
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._factory()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Executors:
+    io: BoundedExecutor
+    render: BoundedExecutor
+    render_workers: int
+
+    def __init__(self,
+                 io_threads: int = 8,
+                 render_workers: int = min(4, cpu_count() or 1),
+                 render_executor: str = 'process',
+                 max_pending: int = 64):
+        self.io = BoundedExecutor(
+            ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='bugis-io'),
+            max_pending
+        )
+        self.render_workers = render_workers
+        if render_executor == 'process':
+            def process_pool() -> Executor:
+                # Never fork a process that is already running the watchdog observer threads
+                return ProcessPoolExecutor(max_workers=render_workers, mp_context=get_context('spawn'))
+
+            self.render = BoundedExecutor(process_pool(), max_pending, process_pool)
+        elif render_executor == 'thread':
+            self.render = BoundedExecutor(
+                ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix='bugis-render'),
+                max_pending
+            )
+        else:
+            raise ValueError(f"Unsupported render executor '{render_executor}'")
+
+    def shutdown(self) -> None:
+        self.io.shutdown()
+        self.render.shutdown()
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os.path import join, relpath, splitext, dirname, abspath, exists
+from stat import S_ISREG
+from shutil import which
+from time import monotonic
+from typing import Any, Iterable, Optional, Sequence
+
+from .compression import ENCODERS, MIN_COMPRESSION_SIZE, compress
+from .graphviz import render_graph
+from .md2html import compile_html, load_static, static_url, render_version, STATIC_RESOURCES, MARDOWN_EXTENSIONS
+from .validators import stat_key, hash_file
+
+MANIFEST = '.bugis-manifest.json'
+SUFFIXES = {'gzip': '.gz', 'br': '.br', 'zstd': '.zst'}
+COMPRESSIBLE = frozenset(('.html', '.svg', '.css', '.js'))
+# Relative and absolute links to documents, which get exported under a different name
+_DOCUMENT_LINK = re.compile(r'((?:href|src)=")(?![a-zA-Z][a-zA-Z0-9+.-]*:)([^"#?]*)\.(md|dot)(?=[#?"])')
+
+logger = logging.getLogger(__name__)
+
+
+def output_name(relative: str) -> str:
+    stem, ext = splitext(relative)
+    if ext == '.md':
+        return stem + '.html'
+    elif ext == '.dot' and which('dot'):
+        return stem + '.svg'
+    return relative
+
+
+def _rewrite_links(html: str) -> str:
+    return _DOCUMENT_LINK.sub(lambda m: m[1] + output_name(f'{m[2]}.{m[3]}'), html)
+
+
+def _write(destination_root: str, relative: str, content: bytes) -> list[str]:
+    path = join(destination_root, relative)
+    os.makedirs(dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    outputs = [relative]
+    if len(content) >= MIN_COMPRESSION_SIZE and splitext(relative)[1] in COMPRESSIBLE:
+        for encoding in ENCODERS:
+            with open(path + SUFFIXES[encoding], 'wb') as f:
+                f.write(compress(content, encoding, best=True))
+            outputs.append(relative + SUFFIXES[encoding])
+    return outputs
+
+
+def export_file(source_root: str,
+                destination_root: str,
+                relative: str,
+                previous_digest: Optional[str]) -> tuple[str, Optional[list[str]]]:
+    """Export a single file, returns its digest and the outputs written or None if the source did not change"""
+    source = join(source_root, relative)
+    digest = hash_file(source)
+    if digest == previous_digest:
+        return digest, None
+    name = output_name(relative)
+    if relative.endswith('.md'):
+        url_path = '/' + relative.replace(os.sep, '/')
+        html = compile_html(url_path, source, extensions=MARDOWN_EXTENSIONS, hot_reload=False)
+        return digest, _write(destination_root, name, _rewrite_links(html).encode())
+    elif relative.endswith('.dot') and name != relative:
+        with open(source, 'rb') as f:
+            return digest, _write(destination_root, name, render_graph(f.read()))
+    else:
+        destination = join(destination_root, name)
+        os.makedirs(dirname(destination), exist_ok=True)
+        shutil.copyfile(source, destination)
+        return digest, [name]
+
+
+def _remove(destination_root: str, outputs: Iterable[str]) -> None:
+    for output in outputs:
+        try:
+            os.unlink(join(destination_root, output))
+        except FileNotFoundError:
+            pass
+
+
+def export(source_root: str, destination_root: str, jobs: Optional[int] = None, force: bool = False) -> dict[str, int]:
+    """Render every document below source_root into destination_root.
+
+    The manifest written in destination_root records the stat key, digest and outputs of every
+    source, so that the next export only renders the files whose content changed.
+    """
+    source_root = abspath(source_root)
+    destination_root = abspath(destination_root)
+    version = render_version()
+    manifest_path = join(destination_root, MANIFEST)
+    previous: dict[str, dict[str, Any]] = {}
+    if not force and exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            content = json.load(f)
+        if content.get('version') == version:
+            previous = content['files']
+    files: dict[str, dict[str, Any]] = {}
+    stats = {'rendered': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+
+    for resource in STATIC_RESOURCES:
+        _write(destination_root, static_url(resource).lstrip('/'), load_static(resource)[0])
+
+    pending = []
+    for directory, subdirectories, filenames in os.walk(source_root):
+        # Skip hidden directories and the destination itself, should it be inside the source tree
+        subdirectories[:] = sorted(
+            it for it in subdirectories if not it.startswith('.') and join(directory, it) != destination_root
+        )
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue
+            path = join(directory, filename)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                # Dangling symlink
+                continue
+            if not S_ISREG(st.st_mode):
+                continue
+            relative = relpath(path, source_root)
+            key = list(stat_key(st))
+            entry = previous.get(relative)
+            if entry is None or not all(exists(join(destination_root, it)) for it in entry['outputs']):
+                pending.append((relative, key, None))
+            elif entry['stat'] == key:
+                files[relative] = entry
+                stats['unchanged'] += 1
+            else:
+                pending.append((relative, key, entry['digest']))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=get_context('spawn')) as executor:
+            futures = [
+                (relative, key, executor.submit(export_file, source_root, destination_root, relative, digest))
+                for relative, key, digest in pending
+            ]
+            for relative, key, future in futures:
+                try:
+                    digest, outputs = future.result()
+                except Exception as e:
+                    logger.warning('Unable to export %s: %s', relative, e)
+                    stats['failed'] += 1
+                    # Keep the outputs of the last successful export, the old stat key gets it retried next time
+                    if relative in previous:
+                        files[relative] = previous[relative]
+                    continue
+                if outputs is None:
+                    files[relative] = dict(previous[relative], stat=key)
+                    stats['unchanged'] += 1
+                else:
+                    if relative in previous:
+                        _remove(destination_root, set(previous[relative]['outputs']).difference(outputs))
+                    files[relative] = {'stat': key, 'digest': digest, 'outputs': outputs}
+                    stats['rendered'] += 1
+
+    for relative, entry in previous.items():
+        if relative not in files:
+            _remove(destination_root, entry['outputs'])
+            stats['removed'] += 1
+
+    temporary = manifest_path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump({'version': version, 'files': files}, f)
+    os.replace(temporary, manifest_path)
+    return stats
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = ArgumentParser(description='Export a tree of Markdown documents as a static site')
+    parser.add_argument('source', help='root of the documents to export')
+    parser.add_argument('destination', help='directory the site is written to')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-f', '--force', action='store_true', help='render every document, ignoring the manifest')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    start = monotonic()
+    stats = export(args.source, args.destination, args.jobs, args.force)
+    logger.info('Exported %s to %s in %.2fs: %d rendered, %d unchanged, %d removed, %d failed',
+                args.source, args.destination, monotonic() - start,
+                stats['rendered'], stats['unchanged'], stats['removed'], stats['failed'])
+    if stats['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
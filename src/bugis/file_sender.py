@@ -0,0 +1,169 @@
+from email.utils import formatdate
+from os import stat_result
+from os.path import abspath
+from typing import Any, Awaitable, BinaryIO, Callable, Optional
+
+from .executor import BoundedExecutor
+
+ZEROCOPY_SEND = 'http.response.zerocopysend'
+PATH_SEND = 'http.response.pathsend'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Parse a single 'bytes' range into an inclusive (start, end) pair.
+
+    Returns None when the whole representation has to be sent, which is also
+    the case for multiple ranges and unknown units.
+    """
+    if not range_header:
+        return None
+    unit, _, ranges = range_header.strip().partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            if start >= size:
+                raise RangeNotSatisfiable()
+            end = int(last) if last else size - 1
+            if end < start:
+                return None
+            end = min(end, size - 1)
+        elif last:
+            suffix = int(last)
+            if suffix == 0:
+                raise RangeNotSatisfiable()
+            elif size == 0:
+                # Satisfiable, but there is no byte to put in a 206: the empty representation is sent whole
+                return None
+            start = max(0, size - suffix)
+            end = size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    if size == 0:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def if_range_matches(if_range: Optional[str], etag: str, last_modified: str) -> bool:
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('W/'):
+        return False
+    elif if_range.startswith('"'):
+        return if_range == etag
+    else:
+        return if_range == last_modified
+
+
+async def send_file(send: Callable[[dict[str, Any]], Awaitable[None]],
+                    path: str,
+                    st: stat_result,
+                    mime_type: str,
+                    digest: str,
+                    io: BoundedExecutor,
+                    extensions: Optional[dict[str, Any]] = None,
+                    range_header: Optional[str] = None,
+                    if_range: Optional[str] = None,
+                    bufsize: int = 0x40000) -> None:
+    size = st.st_size
+    etag = f'"{digest}"'
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    headers = [
+        (b'Content-Type', mime_type.encode()),
+        (b'Etag', etag.encode()),
+        (b'Last-Modified', last_modified.encode()),
+        (b'Accept-Ranges', b'bytes'),
+        (b'Cache-Control', b'no-cache'),
+    ]
+    try:
+        byte_range = parse_range(range_header, size) if if_range_matches(if_range, etag, last_modified) else None
+    except RangeNotSatisfiable:
+        headers.append((b'Content-Range', f'bytes */{size}'.encode()))
+        await send({
+            'type': 'http.response.start',
+            'status': 416,
+            'headers': headers
+        })
+        await send({
+            'type': 'http.response.body',
+        })
+        return
+    if byte_range is None:
+        status, offset, count = 200, 0, size
+    else:
+        start, end = byte_range
+        status, offset, count = 206, start, end - start + 1
+        headers.append((b'Content-Range', f'bytes {start}-{end}/{size}'.encode()))
+    headers.append((b'Content-Length', str(count).encode()))
+    extensions = extensions or {}
+
+    if status == 200 and PATH_SEND in extensions:
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers
+        })
+        await send({
+            'type': PATH_SEND,
+            'path': abspath(path)
+        })
+        return
+
+    f: BinaryIO = await io.submit(open, path, 'rb')
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers
+        })
+        if ZEROCOPY_SEND in extensions:
+            await send({
+                'type': ZEROCOPY_SEND,
+                'file': f,
+                'offset': offset,
+                'count': count,
+            })
+            return
+
+        def read_chunk(position: int, length: int) -> bytes:
+            f.seek(position)
+            return f.read(length)
+
+        position = offset
+        remaining = count
+        while remaining > 0:
+            chunk = await io.submit_unbounded(read_chunk, position, min(bufsize, remaining))
+            if not chunk:
+                break
+            position += len(chunk)
+            remaining -= len(chunk)
+            await send({
+                'type': 'http.response.body',
+                'body': chunk,
+                'more_body': remaining > 0
+            })
+        if remaining > 0:
+            # The file has been truncated while it was being sent
+            await send({
+                'type': 'http.response.body',
+                'body': b'',
+                'more_body': False
+            })
+        elif count == 0:
+            await send({
+                'type': 'http.response.body',
+                'body': b'',
+            })
+    finally:
+        await io.submit_unbounded(f.close)
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import signal
+import subprocess
+from shutil import which
+from typing import Optional
+
+from .executor import ExecutorSaturated
+
+# Layout engines that can be selected with the -K option of the dot executable
+LAYOUT_ENGINES = frozenset(('dot', 'neato', 'fdp', 'sfdp', 'circo', 'twopi', 'osage', 'patchwork'))
+
+
+class GraphvizError(Exception):
+    pass
+
+
+class GraphvizTimeout(GraphvizError):
+    pass
+
+
+def _limit_memory(command: list[str], memory_limit: Optional[int]) -> list[str]:
+    """Run command through a shell that sets its address space limit first.
+
+    A preexec_fn would do the same without the shell, but running Python between fork and exec
+    can deadlock in a process with other threads, like the server and its watchdog observers.
+    """
+    if not memory_limit:
+        return command
+    return ['/bin/sh', '-c', f'ulimit -v {max(1, memory_limit // 1024)} && exec "$@"', 'sh'] + command
+
+
+def _command(executable: str, prog: str, path: Optional[str] = None) -> list[str]:
+    if prog not in LAYOUT_ENGINES:
+        raise ValueError(f"Unsupported layout engine '{prog}'")
+    command = [executable, f'-K{prog}', '-Tsvg']
+    if path is not None:
+        command.append(path)
+    return command
+
+
+def render_graph(source: bytes,
+                 prog: str = 'dot',
+                 timeout: float = 10,
+                 memory_limit: Optional[int] = 512 * 1024 * 1024,
+                 executable: str = 'dot') -> bytes:
+    """Blocking counterpart of GraphRenderer.render, meant for the render workers"""
+    with subprocess.Popen(_limit_memory(_command(executable, prog), memory_limit),
+                          stdin=subprocess.PIPE,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE,
+                          start_new_session=True) as process:
+        try:
+            stdout, stderr = process.communicate(source, timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            raise GraphvizTimeout(f'Graphviz did not complete within {timeout} seconds')
+    if process.returncode:
+        raise GraphvizError(stderr.decode(errors='replace').strip())
+    return stdout
+
+
+class GraphRenderer:
+    """Run the Graphviz executable in a bounded number of subprocesses.
+
+    Every job gets a timeout and an address space limit, so that a
+    pathological graph is killed instead of stalling its request.
+    """
+    _executable: Optional[str]
+    _semaphore: asyncio.Semaphore
+    _max_pending: int
+    _pending: int
+    timeout: float
+    memory_limit: Optional[int]
+
+    def __init__(self,
+                 max_jobs: int = 4,
+                 max_pending: int = 64,
+                 timeout: float = 10,
+                 memory_limit: Optional[int] = 512 * 1024 * 1024,
+                 executable: str = 'dot'):
+        self._executable = which(executable)
+        self._semaphore = asyncio.Semaphore(max_jobs)
+        self._max_pending = max_pending
+        self._pending = 0
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+
+    @property
+    def available(self) -> bool:
+        return self._executable is not None
+
+    async def render(self, path: str, prog: str = 'dot') -> bytes:
+        if self._executable is None:
+            raise GraphvizError('Graphviz is not installed')
+        if self._pending >= self._max_pending:
+            raise ExecutorSaturated()
+        command = _limit_memory(_command(self._executable, prog, path), self.memory_limit)
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                process = await asyncio.create_subprocess_exec(*command,
+                                                               stdin=subprocess.DEVNULL,
+                                                               stdout=subprocess.PIPE,
+                                                               stderr=subprocess.PIPE,
+                                                               start_new_session=True)
+                try:
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+                except asyncio.TimeoutError:
+                    raise GraphvizTimeout(f'Graphviz did not complete within {self.timeout} seconds')
+                finally:
+                    if process.returncode is None:
+                        # Kill the whole process group, nothing must keep the pipes open
+                        os.killpg(process.pid, signal.SIGKILL)
+                        await process.wait()
+        finally:
+            self._pending -= 1
+        if process.returncode:
+            raise GraphvizError(stderr.decode(errors='replace').strip())
+        return stdout
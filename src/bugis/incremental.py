@@ -0,0 +1,249 @@
+import json
+import re
+from contextlib import ExitStack
+from difflib import SequenceMatcher
+from hashlib import sha1
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, NamedTuple, Sequence, Union
+
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+
+from .engines import markdown_engine
+from .render_cache import RenderCache
+
+if TYPE_CHECKING:
+    from _typeshed import StrOrBytesPath
+
+_FENCE = re.compile(r'^(~{3,}|`{3,})')
+_LIST_ITEM = re.compile(r'^([*+-]|\d+[.)])(\s|$)')
+_DEFINITION = re.compile(r'^:[ \t]')
+_REFERENCE = re.compile(r'^ {0,3}\[([^\]^][^\]]*)\]:\s*\S')
+# Footnotes and abbreviations affect the whole document, blocks cannot be rendered on their own
+_GLOBAL_DEFINITION = re.compile(r'^ {0,3}(\[\^[^\]]+\]|\*\[[^\]]+\]):')
+_TAG = re.compile(r'<(/?)([a-zA-Z][\w-]*)[^>]*?(/?)>')
+_VOID_ELEMENTS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'
+))
+
+
+def _html_depth(line: str) -> int:
+    depth = line.count('<!--') - line.count('-->')
+    for closing, tag, self_closing in _TAG.findall(line):
+        if self_closing or tag.lower() in _VOID_ELEMENTS:
+            continue
+        depth += -1 if closing else 1
+    return depth
+
+
+def _starts_block(line: str) -> bool:
+    return not (line[0] in ' \t:>' or _LIST_ITEM.match(line))
+
+
+def _lines(source: str) -> Iterator[tuple[str, bool]]:
+    """Yield every line of source together with whether it is the inside of a fenced code block.
+
+    Fences are located with the very same regular expression used by the fenced_code extension,
+    so that things that merely look like a fence are treated the same way.
+    """
+    fences = FencedBlockPreprocessor.FENCED_BLOCK_RE.finditer(source)
+    fence = next(fences, None)
+    position = 0
+    for line in source.split('\n'):
+        while fence and fence.end() <= position:
+            fence = next(fences, None)
+        yield line, fence is not None and fence.start() < position < fence.end()
+        position += len(line) + 1
+
+
+def _stream_lines(lines: Iterable[str]) -> Iterator[tuple[str, bool]]:
+    """Same as _lines for text that is read a line at a time.
+
+    A fence that is never closed keeps everything after it in the same block, which only
+    makes blocks coarser than they need to be.
+    """
+    fence: Optional[str] = None
+    for line in lines:
+        if line.endswith('\n'):
+            line = line[:-1]
+        if fence is None:
+            yield line, False
+            m = _FENCE.match(line)
+            if m:
+                fence = m.group(1)
+        else:
+            yield line, True
+            if line.startswith(fence) and not line[len(fence):].strip(' '):
+                fence = None
+
+
+def _definitions(lines: Iterable[tuple[str, bool]]) -> tuple[list[str], bool]:
+    """Reference definitions of a document and whether it has any definition that affects all of it"""
+    references: list[str] = []
+    for line, fenced in lines:
+        if fenced:
+            continue
+        elif _GLOBAL_DEFINITION.match(line):
+            return [], True
+        elif _REFERENCE.match(line):
+            references.append(line)
+    return references, False
+
+
+def _join(block: list[str]) -> str:
+    end = len(block)
+    while end > 0 and not block[end - 1].strip():
+        end -= 1
+    return '\n'.join(block[:end])
+
+
+def split_blocks(source: str) -> Iterator[str]:
+    """Split Markdown source into top level blocks that render independently.
+
+    A block only ends at a blank line followed by an unindented line that
+    cannot continue it (list items, definitions, indented code and open
+    fenced code or raw HTML blocks are kept together), so that the
+    concatenation of the rendered blocks matches the rendering of the whole text.
+    """
+    return _split(_lines(source))
+
+
+def _with_next(lines: Iterable[tuple[str, bool]]) -> Iterator[tuple[str, bool, Optional[tuple[str, bool]]]]:
+    """Yield every line together with the first line after it that is not blank, if any"""
+    pending: list[tuple[str, bool]] = []
+    for current in lines:
+        if current[1] or current[0].strip():
+            for line, fenced in pending:
+                yield line, fenced, current
+            pending.clear()
+        pending.append(current)
+    for line, fenced in pending:
+        yield line, fenced, None
+
+
+def _split(lines: Iterable[tuple[str, bool]]) -> Iterator[str]:
+    block: list[str] = []
+    html_depth = 0
+    after_blank = False
+    # Whether block is a definition list, that a term and its definitions further down still belong to
+    definitions = False
+    for line, fenced, following in _with_next(lines):
+        if fenced:
+            block.append(line)
+            after_blank = False
+            continue
+        if not line.strip():
+            if block:
+                block.append(line)
+                after_blank = True
+            continue
+        if after_blank and html_depth <= 0 and _starts_block(line) and not (
+                definitions and following is not None and not following[1] and _DEFINITION.match(following[0])):
+            yield _join(block)
+            block = []
+            html_depth = 0
+            definitions = False
+        after_blank = False
+        block.append(line)
+        if _DEFINITION.match(line):
+            definitions = True
+        if line.lstrip().startswith('<') or html_depth > 0:
+            html_depth += _html_depth(line)
+    if block:
+        yield _join(block)
+
+
+def block_hash(block: str, salt: str = '') -> str:
+    return sha1((salt + block).encode()).hexdigest()[:16]
+
+
+class Document(NamedTuple):
+    fingerprint: str
+    hashes: tuple[str, ...]
+    blocks: tuple[str, ...]
+
+    @property
+    def html(self) -> str:
+        result = [f'<!--document:{self.fingerprint}-->']
+        for h, html in zip(self.hashes, self.blocks):
+            result.append(f'<!--block:{h}-->')
+            result.append(html)
+        return '\n'.join(result)
+
+    def patch(self, base: Sequence[str], base_fingerprint: str) -> bytes:
+        """JSON patch that rebuilds this document from the blocks of base.
+
+        Every operation is either [start, count], copying a run of blocks from base,
+        or [hash, html] for a block that base does not have. The fingerprint of base
+        lets the client check the patch applies to what it currently shows.
+        """
+        positions = {h: i for i, h in enumerate(base)}
+        operations: list[tuple[Union[int, str], Union[int, str]]] = []
+        matcher = SequenceMatcher(None, base, self.hashes, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                operations.append((i1, i2 - i1))
+            else:
+                for h, html in zip(self.hashes[j1:j2], self.blocks[j1:j2]):
+                    position = positions.get(h)
+                    operations.append((h, html) if position is None else (position, 1))
+        return json.dumps({
+            'base': base_fingerprint,
+            'document': self.fingerprint,
+            'operations': operations
+        }, separators=(',', ':')).encode()
+
+
+class BlockRenderer:
+    _cache: RenderCache[str]
+
+    def __init__(self, max_size: int = 16 * 1024 * 1024):
+        self._cache = RenderCache(max_size)
+
+    @property
+    def cache(self) -> RenderCache[str]:
+        return self._cache
+
+    def render(self, source: str, extensions: Optional[list[str]] = None) -> Document:
+        references, whole = _definitions(_lines(source))
+        blocks = [source] if whole else split_blocks(source)
+        hashes: list[str] = []
+        rendered: list[str] = []
+        for h, html in self.render_blocks(blocks, references, extensions or []):
+            hashes.append(h)
+            rendered.append(html)
+        fingerprint = block_hash(''.join(hashes))
+        return Document(fingerprint, tuple(hashes), tuple(rendered))
+
+    def stream(self, path: 'StrOrBytesPath', extensions: Optional[list[str]] = None) -> Iterator[tuple[str, str]]:
+        """Render the Markdown file at path a block at a time, without ever holding all of it in memory"""
+        with open(path, 'r') as f:
+            references, whole = _definitions(_stream_lines(f))
+        with open(path, 'r') as f:
+            blocks = [f.read()] if whole else _split(_stream_lines(f))
+            yield from self.render_blocks(blocks, references, extensions or [])
+
+    def render_blocks(self,
+                      blocks: Iterable[str],
+                      references: Sequence[str],
+                      extensions: list[str]) -> Iterator[tuple[str, str]]:
+        """Yield the hash and the HTML of every block, rendering only those that are not cached"""
+        salt = '\n'.join(extensions) + '\n' + '\n'.join(references)
+        with ExitStack() as stack:
+            md = None
+            resolved_references: dict[str, tuple[str, str]] = {}
+            for block in blocks:
+                h = block_hash(block, salt)
+                html = self._cache.get(h)
+                if html is None:
+                    if md is None:
+                        md = stack.enter_context(markdown_engine(extensions))
+                        if references:
+                            md.convert('\n\n'.join(references))
+                            resolved_references = dict(md.references)
+                    md.reset()
+                    md.references.update(resolved_references)
+                    html = md.convert(block)
+                    self._cache.put(h, html)
+                yield h, html
+
+
+BLOCK_RENDERER = BlockRenderer()
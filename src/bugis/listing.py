@@ -0,0 +1,67 @@
+from html import escape
+from os import scandir
+from typing import NamedTuple
+from urllib.parse import quote
+
+PAGE_SIZE = 1000
+
+
+class Listing(NamedTuple):
+    directories: tuple[str, ...]
+    documents: tuple[str, ...]
+
+    def __len__(self) -> int:
+        return len(self.directories) + len(self.documents)
+
+
+def scan_directory(path: str) -> Listing:
+    """List the subdirectories and the Markdown documents of path with a single scandir pass"""
+    directories = []
+    documents = []
+    with scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    directories.append(entry.name)
+                elif entry.name.endswith('.md') and entry.is_file():
+                    documents.append(entry.name)
+            except OSError:
+                # Broken symlinks and entries removed in the meantime
+                continue
+    directories.sort()
+    documents.sort()
+    return Listing(tuple(directories), tuple(documents))
+
+
+def render_listing(url_path: str, icon_path: str, listing: Listing, page: int = 0, page_size: int = PAGE_SIZE) -> str:
+    title = escape(f'Directory listing for {url_path}')
+    pages = max(1, -(-len(listing) // page_size))
+    result = [
+        '<!DOCTYPE html><html><head>',
+        f'<link rel="icon" type="image/x-icon" href="{escape(icon_path)}">',
+        '<meta http-equiv="Content-Type" content="text/html; charset=utf-8">',
+        f'<title>{title}</title></head>',
+        f'<body><h1>{title}</h1><hr>',
+        '<ul>',
+    ]
+    if url_path != '/' and page == 0:
+        result.append('<li><a href="../">../</a></li>')
+    start = page * page_size
+    end = start + page_size
+    for name in listing.directories[start:end]:
+        result.append(f'<li><a href="{quote(name)}/">{escape(name)}/</a></li>')
+    start = max(0, start - len(listing.directories))
+    end = max(0, end - len(listing.directories))
+    for name in listing.documents[start:end]:
+        result.append(f'<li><a href="{quote(name)}">{escape(name)}</a></li>')
+    result.append('</ul>')
+    if pages > 1:
+        result.append('<hr><p>')
+        if page > 0:
+            result.append(f'<a href="?page={page - 1}">&laquo; previous</a> ')
+        result.append(f'page {page + 1} of {pages}')
+        if page + 1 < pages:
+            result.append(f' <a href="?page={page + 1}">next &raquo;</a>')
+        result.append('</p>')
+    result.append('</body></html>')
+    return ''.join(result)
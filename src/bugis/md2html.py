@@ -1,12 +1,13 @@
 import sys
-from os.path import dirname, join, relpath
+from hashlib import sha1
+from os.path import dirname, join, relpath, splitext
+from shutil import which
 from time import time
 from typing import Optional, TYPE_CHECKING
 
-import markdown
-
 if TYPE_CHECKING:
     from _typeshed import StrOrBytesPath
+    from .incremental import Document
 
 STATIC_RESOURCES: set[str] = {
     '/github-markdown.css',
@@ -16,11 +17,12 @@ STATIC_RESOURCES: set[str] = {
     '/markdown.svg'
 }
 STATIC_CACHE: dict[str, tuple[str, float]] = {}
+STATIC_CONTENT: dict[str, tuple[bytes, str]] = {}
 
-MARDOWN_EXTENSIONS = ['extra', 'smarty', 'tables', 'codehilite']
+MARDOWN_EXTENSIONS = ['extra', 'smarty', 'tables', 'codehilite', 'bugis.dot_fence']
 
 
-def load_from_cache(path) -> tuple[str, float]:
+def load_from_cache(path: str) -> tuple[str, float]:
     global STATIC_CACHE
     if path not in STATIC_CACHE:
         with open(join(dirname(__file__), 'static') + path, 'r') as static_file:
@@ -28,21 +30,72 @@ def load_from_cache(path) -> tuple[str, float]:
     return STATIC_CACHE[path]
 
 
-def compile_html(url_path,
+def load_static(path: str) -> tuple[bytes, str]:
+    global STATIC_CONTENT
+    if path not in STATIC_CONTENT:
+        with open(join(dirname(__file__), 'static') + path, 'rb') as static_file:
+            content = static_file.read()
+            STATIC_CONTENT[path] = (content, sha1(content).hexdigest())
+    return STATIC_CONTENT[path]
+
+
+def static_url(path: str) -> str:
+    stem, ext = splitext(path)
+    return f'{stem}.{load_static(path)[1][:12]}{ext}'
+
+
+def render_version() -> str:
+    """Identify everything besides the source and render options that rendered pages depend upon"""
+    # Package metadata rather than the modules themselves, the server process does not need to import them
+    from importlib.metadata import version, PackageNotFoundError
+    hasher = sha1()
+    for package in ('bugis', 'Markdown', 'Pygments'):
+        try:
+            hasher.update(f'{package} {version(package)}\n'.encode())
+        except PackageNotFoundError:
+            pass
+    # Whether ```dot blocks are rendered depends on Graphviz being installed
+    hasher.update(f'{which("dot")}\n'.encode())
+    hasher.update(load_from_cache('/template.html')[0].encode())
+    for resource in sorted(STATIC_RESOURCES):
+        hasher.update(load_static(resource)[1].encode())
+    return hasher.hexdigest()
+
+
+def compile_html(url_path: str,
                  mdfile: 'StrOrBytesPath',
-                 prefix: Optional['StrOrBytesPath'] = None,
+                 prefix: Optional[str] = None,
                  extensions: Optional[list[str]] = None,
-                 raw: bool = False) -> str:
+                 raw: bool = False,
+                 hot_reload: bool = True) -> str:
+    return compile_document(url_path, mdfile, prefix, extensions, raw, hot_reload)[0]
+
+
+def compile_document(url_path: str,
+                     mdfile: 'StrOrBytesPath',
+                     prefix: Optional[str] = None,
+                     extensions: Optional[list[str]] = None,
+                     raw: bool = False,
+                     hot_reload: bool = True) -> tuple[str, 'Document']:
+    from .incremental import BLOCK_RENDERER
     with mdfile and open(mdfile, 'r') or sys.stdin as instream:
-        html = markdown.markdown(instream.read(), extensions=extensions, output_format='html')
+        document = BLOCK_RENDERER.render(instream.read(), extensions)
+    html = document.html
     if raw:
-        doc = html
-    else:
-        parent = dirname(url_path)
-        prefix = prefix or relpath('/', start=parent)
-        script = f'<script src="{prefix}/hot-reload.js", type="text/javascript" defer="true"></script>'
-        css = f'<link rel="icon" type="image/x-icon" href="{prefix}/markdown.svg">'
-        for css_file in ('github-markdown.css', 'pygment.css', 'custom.css'):
-            css += f'        <link rel="stylesheet" href="{prefix}/{css_file}">'
-        doc = load_from_cache('/template.html')[0].format(content=html, script=script, css=css)
-    return doc
+        return html, document
+    head, tail = page_template(url_path, prefix, hot_reload)
+    return head + html + tail, document
+
+
+def page_template(url_path: str, prefix: Optional[str] = None, hot_reload: bool = True) -> tuple[str, str]:
+    """The HTML page that goes before and after the rendered content"""
+    parent = dirname(url_path)
+    prefix = prefix or relpath('/', start=parent)
+    script = ''
+    if hot_reload:
+        script = f'<script src="{prefix}{static_url("/hot-reload.js")}", type="text/javascript" defer="true"></script>'
+    css = f'<link rel="icon" type="image/x-icon" href="{prefix}{static_url("/markdown.svg")}">'
+    for css_file in ('/github-markdown.css', '/pygment.css', '/custom.css'):
+        css += f'        <link rel="stylesheet" href="{prefix}{static_url(css_file)}">'
+    head, tail = load_from_cache('/template.html')[0].split('{content}')
+    return head.format(script=script, css=css), tail
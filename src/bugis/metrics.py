@@ -0,0 +1,177 @@
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Awaitable, Callable, ContextManager, Iterable, Iterator, Optional
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NOT_TIMED = nullcontext()
+
+# The send callable of ASGI
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+
+
+class RequestTiming:
+    """Durations of the stages of a single request, in the order they completed"""
+    __slots__ = ('start', 'stages', 'lookups', 'status')
+    start: float
+    stages: list[tuple[str, float]]
+    lookups: list[tuple[str, bool]]
+    status: Optional[int]
+
+    def __init__(self) -> None:
+        self.start = perf_counter()
+        self.stages = []
+        self.lookups = []
+        self.status = None
+
+    def add(self, stage: str, duration: float) -> None:
+        self.stages.append((stage, duration))
+
+    def header(self) -> bytes:
+        entries = [f'{stage};dur={duration * 1000:.3f}' for stage, duration in self.stages]
+        entries.append(f'total;dur={(perf_counter() - self.start) * 1000:.3f}')
+        return ', '.join(entries).encode()
+
+
+_timing: ContextVar[Optional[RequestTiming]] = ContextVar('timing', default=None)
+
+
+class _Stage:
+    __slots__ = ('_timing', '_stage', '_start')
+
+    def __init__(self, timing: RequestTiming, stage: str):
+        self._timing = timing
+        self._stage = stage
+
+    def __enter__(self) -> None:
+        self._start = perf_counter()
+
+    def __exit__(self, *_: object) -> None:
+        self._timing.add(self._stage, perf_counter() - self._start)
+
+
+def timed(stage: str) -> ContextManager[None]:
+    """Time the enclosed block as a stage of the current request, a no-op when it is not being timed"""
+    timing = _timing.get()
+    if timing is None:
+        return _NOT_TIMED
+    return _Stage(timing, stage)
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    """Record the outcome of a cache lookup made by the current request"""
+    timing = _timing.get()
+    if timing is not None:
+        timing.lookups.append((cache, hit))
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+    counts: list[int]
+    sum: float
+    count: int
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Aggregate the timings of the requests, exposed in the Prometheus text format"""
+    server_timing: bool
+    _stages: dict[str, Histogram]
+    _requests: dict[int, int]
+    _lookups: dict[tuple[str, bool], int]
+    _gauges: list[Callable[[], Iterable[tuple[str, str, float]]]]
+
+    def __init__(self, server_timing: bool = False):
+        self.server_timing = server_timing
+        self._stages = dict()
+        self._requests = dict()
+        self._lookups = dict()
+        self._gauges = []
+
+    @contextmanager
+    def request(self, send: Send) -> Iterator[Send]:
+        """Time the request handled in the block, which must use the send function it is given"""
+        timing = RequestTiming()
+        token = _timing.set(timing)
+        try:
+            yield self._timed_send(timing, send)
+        finally:
+            _timing.reset(token)
+            self.observe(timing)
+
+    def _timed_send(self, timing: RequestTiming, send: Send) -> Send:
+        async def timed_send(message: dict[str, Any]) -> None:
+            if message['type'] == 'http.response.start':
+                timing.status = message.get('status')
+                if self.server_timing:
+                    message = dict(message)
+                    message['headers'] = list(message.get('headers', ())) + [(b'Server-Timing', timing.header())]
+                await send(message)
+            else:
+                start = perf_counter()
+                await send(message)
+                timing.add('send', perf_counter() - start)
+
+        return timed_send
+
+    def _histogram(self, stage: str) -> Histogram:
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = Histogram()
+        return histogram
+
+    def observe(self, timing: RequestTiming) -> None:
+        for stage, duration in timing.stages:
+            self._histogram(stage).observe(duration)
+        self._histogram('total').observe(perf_counter() - timing.start)
+        if timing.status is not None:
+            self._requests[timing.status] = self._requests.get(timing.status, 0) + 1
+        for lookup in timing.lookups:
+            self._lookups[lookup] = self._lookups.get(lookup, 0) + 1
+
+    def add_gauges(self, gauges: Callable[[], Iterable[tuple[str, str, float]]]) -> None:
+        """Register a callable returning (name, labels, value) samples, collected at every scrape"""
+        self._gauges.append(gauges)
+
+    def exposition(self) -> bytes:
+        lines = [
+            '# HELP bugis_stage_duration_seconds Duration of the stages of the requests',
+            '# TYPE bugis_stage_duration_seconds histogram',
+        ]
+        for stage, histogram in sorted(self._stages.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'bugis_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'bugis_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'bugis_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'bugis_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+        lines.append('# HELP bugis_requests_total Requests by response status')
+        lines.append('# TYPE bugis_requests_total counter')
+        for status, count in sorted(self._requests.items()):
+            lines.append(f'bugis_requests_total{{status="{status}"}} {count}')
+        lines.append('# HELP bugis_cache_lookups_total Cache lookups made by the requests')
+        lines.append('# TYPE bugis_cache_lookups_total counter')
+        for (cache, hit), count in sorted(self._lookups.items()):
+            lines.append(f'bugis_cache_lookups_total{{cache="{cache}",result="{"hit" if hit else "miss"}"}} {count}')
+        types = set()
+        for gauges in self._gauges:
+            for name, labels, value in gauges():
+                if name not in types:
+                    types.add(name)
+                    lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+        lines.append('')
+        return '\n'.join(lines).encode()
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Hashable, Optional, Generic, TypeVar, Sized
+
+V = TypeVar('V', bound=Sized)
+
+
+class RenderCache(Generic[V]):
+    """LRU cache of rendered documents bounded by the total size of its values.
+
+    Every entry holds the identity body and the content encoded variants
+    (gzip, br, ...) that have been produced for it so far, they are evicted together.
+    """
+    _entries: OrderedDict[Hashable, dict[Optional[str], V]]
+    _max_size: int
+    _size: int
+    _lock: Lock
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int = 64 * 1024 * 1024):
+        if max_size < 0:
+            raise ValueError("Cache size must not be negative")
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self._size = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            variants = self._entries.get(key)
+            if variants is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return variants[None]
+
+    def get_variant(self, key: Hashable, encoding: str) -> Optional[V]:
+        with self._lock:
+            variants = self._entries.get(key)
+            return None if variants is None else variants.get(encoding)
+
+    def put(self, key: Hashable, value: V) -> None:
+        if len(value) > self._max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= sum(len(it) for it in previous.values())
+            self._entries[key] = {None: value}
+            self._size += len(value)
+            self._evict()
+
+    def put_variant(self, key: Hashable, encoding: str, value: V) -> None:
+        with self._lock:
+            variants = self._entries.get(key)
+            if variants is None:
+                # Variants are only kept next to their identity body
+                return
+            previous = variants.get(encoding)
+            if previous is not None:
+                self._size -= len(previous)
+            variants[encoding] = value
+            self._size += len(value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            variants = self._entries.pop(key, None)
+            if variants is not None:
+                self._size -= sum(len(it) for it in variants.values())
+
+    def _evict(self) -> None:
+        while self._size > self._max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= sum(len(it) for it in evicted.values())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'size': self._size,
+            'max_size': self._max_size,
+        }
@@ -0,0 +1,112 @@
+import os
+from hashlib import sha1
+from logging import getLogger
+from tempfile import mkstemp
+from threading import Lock
+from typing import Hashable, Optional
+
+logger = getLogger(__name__)
+
+
+class DiskRenderStore:
+    """Content addressed store of rendered documents on the local filesystem.
+
+    Entries are written to a temporary file and renamed in place, so that
+    concurrent writers (other workers included) never expose a partial entry.
+    Reads refresh the modification time of an entry and, once the store grows
+    beyond max_size, the least recently used entries are removed first.
+    """
+    _directory: str
+    _max_size: int
+    _namespace: str
+    _written: int
+    _lock: Lock
+
+    def __init__(self, directory: str, max_size: int = 256 * 1024 * 1024, namespace: str = ''):
+        if max_size <= 0:
+            raise ValueError("Store size must be greater than 0")
+        self._directory = directory
+        self._max_size = max_size
+        self._namespace = namespace
+        # Bytes written since the last eviction pass
+        self._written = 0
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def _path(self, key: Hashable) -> str:
+        digest = sha1(f'{self._namespace}\n{key!r}'.encode()).hexdigest()
+        return os.path.join(self._directory, digest[:2], digest[2:])
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = f.read()
+            os.utime(path)
+            return result
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning('Unable to read %s from the render store: %s', path, e)
+            return None
+
+    def put(self, key: Hashable, value: bytes) -> None:
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, temporary = mkstemp(dir=directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(value)
+                os.replace(temporary, path)
+            except BaseException:
+                os.unlink(temporary)
+                raise
+        except OSError as e:
+            logger.warning('Unable to write %s to the render store: %s', path, e)
+            return
+        with self._lock:
+            self._written += len(value)
+            if self._written < self._max_size // 16:
+                return
+            self._written = 0
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the store is below 90% of its maximum size"""
+        entries: list[tuple[int, int, str]] = []
+        total = 0
+        for shard in os.scandir(self._directory):
+            if not shard.is_dir(follow_symlinks=False):
+                continue
+            try:
+                for entry in os.scandir(shard.path):
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                    total += st.st_size
+            except FileNotFoundError:
+                continue
+        if total <= self._max_size:
+            return
+        entries.sort()
+        threshold = self._max_size * 9 // 10
+        for _, size, path in entries:
+            if total <= threshold:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning('Unable to evict %s from the render store: %s', path, e)
+                continue
+            total -= size
+        logger.debug('Render store evicted down to %d bytes', total)
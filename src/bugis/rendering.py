@@ -0,0 +1,98 @@
+import os
+import socket
+from typing import Optional, TYPE_CHECKING, Sequence
+
+from .md2html import compile_document, page_template
+
+if TYPE_CHECKING:
+    from _typeshed import StrOrBytesPath
+
+# Markdown, its extensions and Pygments are only imported by the render workers, on first use,
+# so that they do not weigh on the startup of the server process
+
+
+_WARM_UP_SAMPLE = '''# Warm up
+
+Some *text* with a [link](warm-up.md) and a footnote[^1].
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+```python
+print("python")
+```
+
+```bash
+echo bash
+```
+
+```json
+{"json": true}
+```
+
+[^1]: Footnote
+'''
+
+
+def markdown_to_html(url_path: str,
+                     path: 'StrOrBytesPath',
+                     prefix: Optional[str],
+                     extensions: list[str],
+                     raw: bool) -> tuple[bytes, str, tuple[str, ...]]:
+    html, document = compile_document(url_path, path, prefix, extensions, raw=raw)
+    return html.encode(), document.fingerprint, document.hashes
+
+
+def stream_markdown(url_path: str,
+                    path: 'StrOrBytesPath',
+                    prefix: Optional[str],
+                    extensions: list[str],
+                    raw: bool,
+                    address: str,
+                    chunk_size: int = 0x10000) -> tuple[str, tuple[str, ...]]:
+    """Render path into the Unix socket listening at address as it goes, returns the document fingerprint and hashes.
+
+    The blocks end up in the same page as markdown_to_html would produce, but for the document
+    comment that comes last, once all the blocks are known.
+    """
+    from .incremental import BLOCK_RENDERER, block_hash
+    head, tail = ('', '') if raw else page_template(url_path, prefix)
+    hashes = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(address)
+        # The head does not depend on the document, the browser can fetch the stylesheets meanwhile
+        if head:
+            connection.sendall(head.encode())
+        buffer: list[str] = []
+        size = 0
+        for h, html in BLOCK_RENDERER.stream(path, extensions):
+            hashes.append(h)
+            buffer.append(f'<!--block:{h}-->\n{html}\n')
+            size += len(buffer[-1])
+            if size >= chunk_size:
+                connection.sendall(''.join(buffer).encode())
+                buffer.clear()
+                size = 0
+        fingerprint = block_hash(''.join(hashes))
+        buffer.append(f'<!--document:{fingerprint}-->{tail}')
+        connection.sendall(''.join(buffer).encode())
+    return fingerprint, tuple(hashes)
+
+
+def markdown_patch(path: 'StrOrBytesPath',
+                   extensions: list[str],
+                   base: Sequence[str],
+                   base_fingerprint: str) -> tuple[bytes, str, tuple[str, ...]]:
+    from .incremental import BLOCK_RENDERER
+    with open(path, 'r') as f:
+        document = BLOCK_RENDERER.render(f.read(), extensions)
+    return document.patch(base, base_fingerprint), document.fingerprint, document.hashes
+
+
+def warm_up(extensions: list[str]) -> int:
+    """Build the Markdown engine of the calling worker and load the most common Pygments lexers"""
+    from .engines import markdown_engine
+    with markdown_engine(extensions) as md:
+        md.convert(_WARM_UP_SAMPLE)
+    return os.getpid()
@@ -0,0 +1,331 @@
+import asyncio
+import math
+import os
+import re
+from array import array
+from collections import Counter
+from heapq import nlargest
+from logging import getLogger
+from os.path import basename, dirname, isdir, join
+from typing import Iterable, NamedTuple, Optional, cast
+
+from .executor import BoundedExecutor
+
+_TOKEN = re.compile(r'\w{2,64}')
+_TITLE = re.compile(r'^#{1,6}\s+(.*?)\s*#*\s*$', re.MULTILINE)
+# Postings pack the document id and the term frequency, saturated at 255, in a single integer
+_TF_BITS = 8
+_TF_MASK = (1 << _TF_BITS) - 1
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+
+class Analysis(NamedTuple):
+    title: str
+    length: int
+    terms: Counter[str]
+
+
+class Hit(NamedTuple):
+    path: str
+    title: str
+    score: float
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def analyze(path: str) -> Optional[Analysis]:
+    """Title and term frequencies of the Markdown document at path, None if it is gone"""
+    try:
+        with open(path, 'r', errors='replace') as f:
+            text = f.read()
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return None
+    m = _TITLE.search(text)
+    tokens = tokenize(text)
+    return Analysis(m.group(1) if m else basename(path), len(tokens), Counter(tokens))
+
+
+def _documents(root: str, directories: set[str]) -> Iterable[str]:
+    """Markdown documents below root, adding every directory walked to directories"""
+    for directory, subdirectories, filenames in os.walk(root):
+        directories.add(directory)
+        subdirectories[:] = [it for it in subdirectories if not it.startswith('.')]
+        for filename in filenames:
+            if filename.endswith('.md') and not filename.startswith('.'):
+                yield join(directory, filename)
+
+
+class SearchIndex:
+    """Inverted index of Markdown documents ranked with BM25.
+
+    Postings are kept in arrays of machine integers rather than in dictionaries, so that a corpus of
+    hundreds of thousands of documents fits in memory; removed documents are only skipped until
+    they make up half of the ids, then the postings are compacted. The document frequency of every
+    term is kept apart, so that it only counts the live documents.
+    """
+    _ids: dict[str, int]
+    _paths: list[Optional[str]]
+    _titles: list[str]
+    _lengths: 'array[int]'
+    _postings: dict[str, 'array[int]']
+    _term_ids: dict[str, int]
+    # Number of live documents with the term, by term id
+    _frequencies: 'array[int]'
+    # Ids of the terms of every document, None once it is removed
+    _document_terms: list[Optional['array[int]']]
+    _directories: dict[str, set[str]]
+    # Every directory of the indexed tree, with documents or not
+    tree: set[str]
+    _total_length: int
+    _removed: int
+    # BM25 length normalization of every document, computed again after any change
+    _norms: Optional[list[float]]
+
+    def __init__(self) -> None:
+        self._ids = dict()
+        self._paths = []
+        self._titles = []
+        self._lengths = array('I')
+        self._postings = dict()
+        self._term_ids = dict()
+        self._frequencies = array('I')
+        self._document_terms = []
+        self._directories = dict()
+        self.tree = set()
+        self._total_length = 0
+        self._removed = 0
+        self._norms = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def documents(self, directory: str) -> list[str]:
+        return list(self._directories.get(directory, ()))
+
+    def add(self, path: str, analysis: Analysis) -> None:
+        self.remove(path)
+        self._norms = None
+        document = len(self._paths)
+        self._ids[path] = document
+        self._paths.append(path)
+        self._titles.append(analysis.title)
+        self._lengths.append(analysis.length)
+        self._total_length += analysis.length
+        self._directories.setdefault(dirname(path), set()).add(path)
+        terms = array('I')
+        for term, frequency in analysis.terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = array('Q')
+            postings.append(document << _TF_BITS | min(frequency, _TF_MASK))
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                term_id = self._term_ids[term] = len(self._frequencies)
+                self._frequencies.append(0)
+            self._frequencies[term_id] += 1
+            terms.append(term_id)
+        self._document_terms.append(terms)
+
+    def remove(self, path: str) -> None:
+        document = self._ids.pop(path, None)
+        if document is None:
+            return
+        self._paths[document] = None
+        self._norms = None
+        terms = self._document_terms[document]
+        assert terms is not None
+        for term_id in terms:
+            self._frequencies[term_id] -= 1
+        self._document_terms[document] = None
+        self._total_length -= self._lengths[document]
+        directory = dirname(path)
+        documents = self._directories[directory]
+        documents.discard(path)
+        if not documents:
+            del self._directories[directory]
+        self._removed += 1
+        if self._removed * 2 > len(self._paths):
+            self._compact()
+
+    def _compact(self) -> None:
+        renumbered = array('q', [-1]) * len(self._paths)
+        paths: list[Optional[str]] = []
+        titles: list[str] = []
+        lengths = array('I')
+        document_terms: list[Optional['array[int]']] = []
+        for document, path in enumerate(self._paths):
+            if path is not None:
+                renumbered[document] = len(paths)
+                self._ids[path] = len(paths)
+                paths.append(path)
+                titles.append(self._titles[document])
+                lengths.append(self._lengths[document])
+                document_terms.append(self._document_terms[document])
+        for term, postings in list(self._postings.items()):
+            compacted = array('Q', (
+                renumbered[it >> _TF_BITS] << _TF_BITS | it & _TF_MASK
+                for it in postings if renumbered[it >> _TF_BITS] >= 0
+            ))
+            if compacted:
+                self._postings[term] = compacted
+            else:
+                del self._postings[term]
+        self._paths, self._titles, self._lengths = paths, titles, lengths
+        self._document_terms = document_terms
+        self._removed = 0
+
+    def search(self, query: str, limit: int = 20, prefix: str = '') -> tuple[int, list[Hit]]:
+        """Number of matching documents below prefix and the limit best ranked ones"""
+        if not self._ids:
+            return 0, []
+        documents = len(self._ids)
+        if self._norms is None:
+            average_length = self._total_length / documents or 1
+            self._norms = [_K1 * (1 - _B + _B * length / average_length) for length in self._lengths]
+        norms = self._norms
+        paths = self._paths
+        terms: list[tuple[int, 'array[int]']] = []
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                frequency = self._frequencies[self._term_ids[term]]
+                if frequency:
+                    terms.append((frequency, postings))
+        terms.sort(key=lambda it: it[0])
+        # Terms found in most documents weigh next to nothing, scanning their postings would take
+        # most of the time: they only count when the query has nothing more selective
+        if terms and terms[0][0] * 2 <= documents:
+            terms = [it for it in terms if it[0] * 2 <= documents]
+        scores: dict[int, float] = {}
+        for frequency, postings in terms:
+            idf = math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+            for posting in postings:
+                document = posting >> _TF_BITS
+                path = paths[document]
+                if path is None or prefix and not path.startswith(prefix):
+                    continue
+                tf = posting & _TF_MASK
+                scores[document] = scores.get(document, 0.0) + idf * tf * (_K1 + 1) / (tf + norms[document])
+        best = nlargest(limit, scores.items(), key=lambda it: it[1])
+        # Only the documents that are still there have a score
+        return len(scores), [Hit(cast(str, paths[document]), self._titles[document], score) for document, score in best]
+
+
+def build_index(root: str) -> SearchIndex:
+    index = SearchIndex()
+    for path in _documents(root, index.tree):
+        analysis = analyze(path)
+        if analysis is not None:
+            index.add(path, analysis)
+    return index
+
+
+def _directory_changes(directory: str, known: list[str]) -> tuple[list[str], set[str], list[str]]:
+    """Known directories below directory that are gone, new subdirectories of it and their documents"""
+    vanished = [it for it in known if not isdir(it)]
+    known_set = set(known)
+    added: set[str] = set()
+    documents: list[str] = []
+    try:
+        with os.scandir(directory) as entries:
+            subdirectories = [it.path for it in entries if not it.name.startswith('.') and it.is_dir()]
+    except OSError:
+        subdirectories = []
+    for subdirectory in subdirectories:
+        if subdirectory not in known_set:
+            documents += _documents(subdirectory, added)
+    return vanished, added, documents
+
+
+class Search:
+    """Full-text search over the Markdown documents below root.
+
+    The index is built once by a job of executor, then kept up to date with the file watcher
+    notifications, which are applied in order by a single task.
+    """
+    _root: str
+    _executor: BoundedExecutor
+    _index: Optional[SearchIndex]
+    _dirty: dict[str, bool]
+    _wakeup: asyncio.Event
+    _task: Optional[asyncio.Task[None]]
+
+    def __init__(self, root: str, executor: BoundedExecutor):
+        self._root = root
+        self._executor = executor
+        self._index = None
+        # Changed paths, and whether they are directories, in the order they were notified
+        self._dirty = dict()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.logger = getLogger(Search.__name__)
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def _indexed(self, path: str) -> bool:
+        """Whether path is root or below it, outside of the hidden directories that are not indexed"""
+        if path == self._root:
+            return True
+        prefix = join(self._root, '')
+        return path.startswith(prefix) and not any(it.startswith('.') for it in path[len(prefix):].split(os.sep))
+
+    def document_changed(self, path: str) -> None:
+        if path.endswith('.md') and self._indexed(path):
+            self._dirty.setdefault(path, False)
+            self._wakeup.set()
+
+    def directory_changed(self, directory: str) -> None:
+        if self._indexed(directory):
+            self._dirty[directory] = True
+            self._wakeup.set()
+
+    def search(self, query: str, limit: int = 20, directory: str = '') -> Optional[tuple[int, list[Hit]]]:
+        """Search the documents below directory, None until the index is built"""
+        if self._index is None:
+            return None
+        prefix = '' if not directory or directory == self._root else join(directory, '')
+        return self._index.search(query, limit, prefix)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        index = await self._executor.submit_unbounded(build_index, self._root)
+        self.logger.info('Indexed %d documents in %.3fs', len(index), loop.time() - start)
+        while True:
+            while self._dirty:
+                path = next(iter(self._dirty))
+                is_directory = self._dirty.pop(path)
+                try:
+                    if is_directory:
+                        known = [it for it in index.tree if it == path or it.startswith(path + os.sep)]
+                        vanished, added, documents = await self._executor.submit_unbounded(
+                            _directory_changes, path, known
+                        )
+                        for directory in vanished:
+                            index.tree.discard(directory)
+                            for document in index.documents(directory):
+                                index.remove(document)
+                        index.tree.update(added)
+                        for document in documents:
+                            self._dirty.setdefault(document, False)
+                    else:
+                        analysis = await self._executor.submit_unbounded(analyze, path)
+                        if analysis is None:
+                            index.remove(path)
+                        else:
+                            index.add(path, analysis)
+                except OSError as e:
+                    self.logger.debug('Unable to index %s: %s', path, e)
+            # Queries are only answered once the changes made during the initial build are applied
+            self._index = index
+            self._wakeup.clear()
+            await self._wakeup.wait()
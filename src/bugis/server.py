@@ -1,15 +1,36 @@
+import asyncio
 import logging
-from os import getcwd, listdir
-from os.path import exists, splitext, isfile, join, relpath, isdir, basename, getmtime, dirname, normpath
+import os
+import shutil
+import socket
+import tempfile
+from contextlib import nullcontext
+from itertools import count
+from os import getcwd, stat, stat_result
+from os.path import splitext, join, relpath, basename, dirname, normpath, abspath
+from stat import S_ISREG, S_ISDIR
 from mimetypes import init as mimeinit, guess_type
-import hashlib
-from .md2html import compile_html, load_from_cache, STATIC_RESOURCES, MARDOWN_EXTENSIONS
-from shutil import which
-import pygraphviz as pgv
-from io import BytesIO
-from typing import Callable, TYPE_CHECKING, BinaryIO, Optional
+import json
+from .md2html import static_url, MARDOWN_EXTENSIONS
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Hashable, NamedTuple, Optional, Sequence, Union
+from urllib.parse import parse_qs
 from .async_watchdog import FileWatcher
-from pwo import Maybe
+from .shared_watcher import SharedFileWatcher
+from .render_cache import RenderCache
+from .render_store import DiskRenderStore
+from .executor import Executors, ExecutorSaturated
+from .rendering import markdown_to_html, markdown_patch, stream_markdown, warm_up
+from .graphviz import GraphRenderer, GraphvizError, GraphvizTimeout, LAYOUT_ENGINES
+from .single_flight import SingleFlight
+from .validators import StatKey, stat_key, stat_validator, hash_file
+from .file_sender import send_file
+from .listing import Listing, scan_directory, render_listing, PAGE_SIZE
+from .compression import MIN_COMPRESSION_SIZE, compress, preferred_encoding
+from .metrics import Metrics, timed, cache_lookup
+from .search import Search
+from .static_table import build_static_table
+from .stat_cache import StatCache
 
 if TYPE_CHECKING:
     from _typeshed import StrOrBytesPath
@@ -32,16 +53,125 @@ def is_dotfile(filepath):
     return has_extension(filepath, ".dot")
 
 
+class CachedListing(NamedTuple):
+    stat: StatKey
+    listing: Listing
+
+    def __len__(self) -> int:
+        # Weighed by the number of names, an empty directory still takes an entry
+        return len(self.listing) + 1
+
+
 class Server:
 
-    def __init__(self, root_dir: 'StrOrBytesPath' = getcwd(), prefix: Optional['StrOrBytesPath'] = None):
+    def __init__(self,
+                 root_dir: 'StrOrBytesPath' = getcwd(),
+                 prefix: Optional['StrOrBytesPath'] = None,
+                 render_cache_size: int = 64 * 1024 * 1024,
+                 executors: Optional[Executors] = None,
+                 validator: str = 'content',
+                 background_hash: bool = False,
+                 render_store: Optional[DiskRenderStore] = None,
+                 graph_renderer: Optional[GraphRenderer] = None,
+                 watch_debounce: float = 0.1,
+                 watch_socket: Optional[str] = None,
+                 metrics: Optional[Metrics] = None,
+                 metrics_path: Optional[str] = None,
+                 stream_threshold: int = 8 * 1024 * 1024,
+                 search: bool = False,
+                 stat_cache_ttl: float = 1.0,
+                 listing_cache_size: int = 1024 * 1024):
+        if validator not in ('content', 'stat'):
+            raise ValueError(f"Unsupported validator '{validator}'")
         self.root_dir = root_dir
-        self.cache = dict['StrOrBytesPath', tuple[str, float]]()
-        self.file_watcher = FileWatcher(cwd)
+        self.cache = dict['StrOrBytesPath', tuple[StatKey, str]]()
+        self.validator = validator
+        self.background_hash = background_hash
+        self._background_tasks = set[asyncio.Task[Any]]()
+        self.render_cache = RenderCache[bytes](render_cache_size)
+        # Block hashes of the recently rendered documents, by document fingerprint
+        self.block_index = RenderCache[tuple[str, ...]](0x100000)
+        self.render_store = render_store
+        self.graph_renderer = graph_renderer or GraphRenderer()
+        # Graphviz failures by source digest and layout engine, so that a broken graph fails fast, oldest first.
+        # Timeouts are left out, they depend on the load as much as on the graph
+        self.graph_errors = dict[tuple[str, str, str], GraphvizError]()
+        self.executors = executors or Executors()
+        self.single_flight = SingleFlight()
+        self.file_watcher: Union[FileWatcher, SharedFileWatcher]
+        if watch_socket:
+            self.file_watcher = SharedFileWatcher(watch_socket, watch_debounce, root=os.fsdecode(cwd))
+        else:
+            self.file_watcher = FileWatcher(cwd, watch_debounce)
+        # Listings by directory, bounded by the total number of names they hold
+        self.listing_cache = RenderCache[CachedListing](listing_cache_size)
+        self.file_watcher.add_listener(self.listing_cache.discard)
+        self.stat_cache = StatCache(stat_cache_ttl)
+        if stat_cache_ttl > 0:
+            # Only the notifications the watcher gets anyway, the time to live covers the other changes
+            self.file_watcher.add_observer(self.stat_cache.invalidate)
+            self.file_watcher.add_listener(self.stat_cache.invalidate_directory)
+        # Normalized URL path and filesystem path by request path
+        self._resolved = dict[str, tuple[str, str]]()
+        self.search: Optional[Search] = None
+        if search:
+            self.search = Search(abspath(os.fsdecode(root_dir)), self.executors.io)
+            self.file_watcher.add_forwarder(self.search.document_changed)
+            self.file_watcher.add_listener(self.search.directory_changed)
+            self.search.start()
         self.logger = logging.getLogger(Server.__name__)
+        self.metrics = metrics
+        # Markdown documents of at least this size are rendered and sent a chunk at a time, never cached
+        self.stream_threshold = stream_threshold
+        self._stream_directory: Optional[str] = None
+        self._streams = count()
+        self.metrics_path = metrics_path
+        if metrics is not None:
+            metrics.add_gauges(self.gauges)
         self.prefix = prefix and normpath(f'{prefix.decode()}')
+        self.static_responses = build_static_table()
+
+    async def stop(self) -> None:
+        if self.search is not None:
+            self.search.stop()
+        await self.file_watcher.stop()
+        self.executors.shutdown()
+        if self._stream_directory is not None:
+            shutil.rmtree(self._stream_directory, ignore_errors=True)
 
-    async def handle_request(self, method: str, url_path: str, etag: Optional[str], query_string: Optional[str], send):
+    async def handle_request(self,
+                             method: str,
+                             url_path: str,
+                             etag: Optional[str],
+                             query_string: Optional[str],
+                             send,
+                             range_header: Optional[str] = None,
+                             if_range: Optional[str] = None,
+                             extensions: Optional[dict[str, Any]] = None,
+                             accept_encoding: Optional[str] = None,
+                             receive=None):
+        if self.metrics is not None and url_path == self.metrics_path:
+            await self.send_metrics(send)
+            return
+        with self.metrics.request(send) if self.metrics is not None else nullcontext(send) as send:
+            try:
+                await self._handle_request(method, url_path, etag, query_string, send,
+                                           range_header, if_range, extensions, accept_encoding, receive)
+            except ExecutorSaturated:
+                self.logger.warning('Rejecting request for %s, worker pool queue is full', url_path)
+                await self.service_unavailable(send)
+
+    async def _handle_request(self,
+                              method: str,
+                              url_path: str,
+                              etag: Optional[str],
+                              query_string: Optional[str],
+                              send,
+                              range_header: Optional[str],
+                              if_range: Optional[str],
+                              extensions: Optional[dict[str, Any]],
+                              accept_encoding: Optional[str],
+                              receive):
         if method != 'GET':
             await send({
                 'type': 'http.response.start',
@@ -52,46 +182,45 @@ class Server:
                 'body': b'',
             })
             return
-        relative_path = relpath(url_path, start=self.prefix or '/')
-        url_path: 'StrOrBytesPath' = normpath(join('/', relative_path))
-        path: 'StrOrBytesPath' = join(self.root_dir, relative_path)
-        if url_path in STATIC_RESOURCES:
-            content, mtime = load_from_cache(url_path)
-            content = content.encode()
-            etag, digest = self.compute_etag_and_digest(
-                etag,
-                url_path,
-                lambda: BytesIO(content),
-                lambda: mtime
-            )
-            if etag and etag == digest:
-                await self.not_modified(send, digest, ('Cache-Control', 'must-revalidate, max-age=86400'))
-                return
-            elif content:
-                mime_type = guess_type(basename(url_path))[0] or 'application/octet-stream'
+        url_path, path = self.resolve(url_path)
+        static = self.static_responses.get(url_path)
+        if static is not None:
+            if etag is not None and Server.parse_etag(etag) == static.digest:
                 await send({
                     'type': 'http.response.start',
-                    'status': 200,
-                    'headers': [
-                        (b'content-type', f'{mime_type}; charset=UTF-8'.encode()),
-                        (b'etag', f'W/"{digest}"'.encode()),
-                        (b'content-type', f'{mime_type}; charset=UTF-8'.encode()),
-                        (b'Cache-Control', b'must-revalidate, max-age=86400'),
-                    ]
+                    'status': 304,
+                    'headers': static.not_modified
                 })
                 await send({
                     'type': 'http.response.body',
-                    'body': content
                 })
                 return
-        elif exists(path):
-            if isfile(path):
-                etag, digest = self.compute_etag_and_digest(
-                    etag,
-                    path,
-                    lambda: open(path, 'rb'),
-                    lambda: getmtime(path)
-                )
+            headers, body = static.headers, static.body
+            if static.variants and accept_encoding:
+                encoding = preferred_encoding(accept_encoding)
+                if encoding is not None:
+                    headers, body = static.variants[encoding]
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': headers
+            })
+            await send({
+                'type': 'http.response.body',
+                'body': body
+            })
+        else:
+            with timed('stat'):
+                st = self.stat_cache.stat(path)
+            if st is None:
+                await self.not_found(send)
+                return
+            if S_ISREG(st.st_mode):
+                if is_markdown(path) and query_string == 'events' and receive:
+                    await self.event_stream(path, receive, send)
+                    return
+                digest = await self.file_digest(path, st)
+                etag = Server.parse_etag(etag)
                 self.logger.debug('%s %s', etag, digest)
                 if etag and etag == digest:
                     if is_markdown(path) and query_string == 'reload':
@@ -99,66 +228,73 @@ class Server:
                         try:
                             has_changed = await subscription.wait(30)
                             if has_changed:
-                                _, digest = self.compute_etag_and_digest(
-                                    etag,
-                                    path,
-                                    lambda: open(path, 'rb'),
-                                    lambda: getmtime(path)
-                                )
+                                try:
+                                    st = stat(path)
+                                except FileNotFoundError:
+                                    st = None
+                                if st is None or not S_ISREG(st.st_mode):
+                                    await self.not_found(send)
+                                    return
+                                digest = await self.file_digest(path, st)
                                 if etag != digest:
-                                    if exists(path) and isfile(path):
-                                        await self.render_markdown(url_path, path, True, digest, send)
-                                        return
+                                    if self.streamed(st):
+                                        await self.stream_markdown(url_path, path, True, digest, send)
                                     else:
-                                        await self.not_found(send)
-                                        return
+                                        await self.render_markdown(url_path, path, True, digest, send,
+                                                                   self.cache_digest(path, st, digest),
+                                                                   accept_encoding)
+                                    return
                         finally:
                             subscription.unsubscribe()
-                    await self.not_modified(send, digest)
+                    # Rendered documents are sent with a weak ETag, other files with a strong one
+                    rendered = is_markdown(path) or is_dotfile(path) and self.graph_renderer.available
+                    await self.not_modified(send, digest, vary=rendered, weak=rendered)
+                elif is_markdown(path) and query_string and query_string.startswith('patch='):
+                    await self.send_patch(path, query_string[6:], digest, send, self.cache_digest(path, st, digest))
+                elif is_markdown(path) and self.streamed(st):
+                    await self.stream_markdown(url_path, path, query_string in ('reload', 'raw'), digest, send)
                 elif is_markdown(path):
-                    raw = query_string == 'reload'
-                    await self.render_markdown(url_path, path, raw, digest, send)
-                elif is_dotfile(path) and which("dot"):
-                    graph = pgv.AGraph(path)
-                    body = graph.draw(None, format="svg", prog="dot")
-                    await send({
-                        'type': 'http.response.start',
-                        'status': 200,
-                        'headers': (
-                            (b'Content-Type', b'image/svg+xml; charset=UTF-8'),
-                            (b'Etag', f'W/"{digest}"'.encode()),
-                            (b'Cache-Control', b'no-cache'),
-                        )
-                    })
-                    await send({
-                        'type': 'http.response.body',
-                        'body': body
-                    })
+                    raw = query_string in ('reload', 'raw')
+                    await self.render_markdown(url_path, path, raw, digest, send,
+                                               self.cache_digest(path, st, digest),
+                                               accept_encoding)
+                elif is_dotfile(path) and self.graph_renderer.available:
+                    if query_string and query_string.startswith('layout='):
+                        prog = query_string[7:]
+                    else:
+                        prog = 'dot'
+                    if prog in LAYOUT_ENGINES:
+                        await self.render_graph(path, prog, digest, send,
+                                                self.cache_digest(path, st, digest),
+                                                accept_encoding)
+                    else:
+                        await self.not_found(send)
                 else:
-                    def read_file(file_path):
-                        buffer_size = 1024
-                        with open(file_path, 'rb') as f:
-                            while True:
-                                result = f.read(buffer_size)
-                                if len(result) == 0:
-                                    break
-                                yield result
-
-                    await send({
-                        'type': 'http.response.start',
-                        'status': 200,
-                        'headers': (
-                            (b'Content-Type', guess_type(basename(path))[0].encode() or b'application/octet-stream'),
-                            (b'Etag', f'W/"{digest}"'),
-                            (b'Cache-Control', b'no-cache')
-                        )
-                    })
-                    await send({
-                        'type': 'http.response.body',
-                        'body': read_file(path)
-                    })
-            elif isdir(path):
-                body = self.directory_listing(url_path, path).encode()
+                    await send_file(send,
+                                    path,
+                                    st,
+                                    guess_type(basename(path))[0] or 'application/octet-stream',
+                                    digest,
+                                    self.executors.io,
+                                    extensions,
+                                    range_header,
+                                    if_range)
+            elif S_ISDIR(st.st_mode) and self.search is not None and query_string \
+                    and query_string.startswith('search='):
+                await self.send_search(normpath(path), query_string, send)
+            elif S_ISDIR(st.st_mode):
+                page = 0
+                if query_string and query_string.startswith('page='):
+                    try:
+                        page = int(query_string[5:])
+                    except ValueError:
+                        pass
+                with timed('listing'):
+                    listing = await self.scan_directory(path, st)
+                if page < 0 or page * PAGE_SIZE >= max(1, len(listing)):
+                    await self.not_found(send)
+                    return
+                body = self.directory_listing(url_path, listing, page).encode()
                 await send({
                     'type': 'http.response.start',
                     'status': 200,
@@ -170,91 +306,363 @@ class Server:
                     'type': 'http.response.body',
                     'body': body
                 })
-        else:
-            await self.not_found(send)
+            else:
+                await self.not_found(send)
 
-    @staticmethod
-    def stream_hash(source: BinaryIO, bufsize=0x1000) -> bytes:
-        if bufsize <= 0:
-            raise ValueError("Buffer size must be greater than 0")
-        md5 = hashlib.md5()
-        while True:
-            buf = source.read(bufsize)
-            if len(buf) == 0:
-                break
-            md5.update(buf)
-        return md5.digest()
+    def resolve(self, url_path: str) -> tuple[str, str]:
+        """Normalized URL path and filesystem path of a request path"""
+        result = self._resolved.get(url_path)
+        if result is None:
+            relative_path = relpath(url_path, start=self.prefix or '/')
+            result = normpath(join('/', relative_path)), join(os.fsdecode(self.root_dir), relative_path)
+            if len(self._resolved) >= 0x10000:
+                self._resolved.clear()
+            self._resolved[url_path] = result
+        return result
 
-    @staticmethod
-    def file_hash(filepath, bufsize=0x1000) -> bytes:
-        if bufsize <= 0:
-            raise ValueError("Buffer size must be greater than 0")
-        md5 = hashlib.md5()
-        with open(filepath, 'rb') as f:
+    async def event_stream(self, path: str, receive, send, keepalive: float = 15) -> None:
+        subscription = self.file_watcher.subscribe(path)
+
+        async def wait_for_disconnect() -> None:
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        disconnection = asyncio.ensure_future(wait_for_disconnect())
+        disconnection.add_done_callback(lambda _: subscription.notify())
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': (
+                    (b'Content-Type', b'text/event-stream; charset=UTF-8'),
+                    (b'Cache-Control', b'no-cache'),
+                    (b'X-Accel-Buffering', b'no'),
+                )
+            })
+            await send({
+                'type': 'http.response.body',
+                'body': b'retry: 1000\n\n',
+                'more_body': True
+            })
             while True:
-                buf = f.read(bufsize)
-                if len(buf) == 0:
+                has_changed = await subscription.wait(keepalive)
+                # Re-arm before yielding to the loop, so that no notification can get lost
+                subscription.reset()
+                if disconnection.done():
                     break
-                md5.update(buf)
-        return md5.digest()
+                await send({
+                    'type': 'http.response.body',
+                    'body': b'event: change\ndata:\n\n' if has_changed else b': keepalive\n\n',
+                    'more_body': True
+                })
+        except OSError:
+            pass
+        finally:
+            disconnection.cancel()
+            subscription.unsubscribe()
 
     @staticmethod
-    def parse_etag(etag: str) -> Optional[str]:
-        def skip_weak_marker(s):
-            if s.startswith('W/'):
-                return s[2:]
-            else:
-                return s
+    def parse_etag(etag: Optional[str]) -> Optional[str]:
+        if etag is None:
+            return None
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        if len(etag) > 1 and etag[0] == '"' and etag[-1] == '"':
+            etag = etag[1:-1]
+        return etag
 
-        return (
-            Maybe.of_nullable(etag)
-                .map(skip_weak_marker)
-                .or_else(None)
+    async def file_digest(self, path: str, st: stat_result) -> str:
+        with timed('digest'):
+            return await self._file_digest(path, st)
+
+    async def _file_digest(self, path: str, st: stat_result) -> str:
+        key = stat_key(st)
+        if self.validator == 'stat':
+            if self.background_hash:
+                self.hash_in_background(path, key)
+            return stat_validator(st)
+        cache_result = self.cache.get(path)
+        hit = cache_result is not None and cache_result[0] == key
+        cache_lookup('digest', hit)
+        if cache_result is not None and hit:
+            return cache_result[1]
+        digest = await self.single_flight.run(
+            ('digest', path, key),
+            lambda: self.executors.io.submit(hash_file, path)
         )
+        self.cache[path] = key, digest
+        return digest
 
-    def compute_etag_and_digest(
-            self,
-            etag_header: str,
-            path: str,
-            stream_source: Callable[[], BinaryIO],
-            mtime_supplier: Callable[[], float]
-    ) -> tuple[str, str]:
+    def cache_digest(self, path: str, st: stat_result, digest: str) -> str:
         cache_result = self.cache.get(path)
-        _mtime: Optional[float] = None
-
-        def mtime() -> float:
-            nonlocal _mtime
-            if not _mtime:
-                _mtime = mtime_supplier()
-            return _mtime
-
-        if not cache_result or cache_result[1] < mtime():
-            with stream_source() as stream:
-                digest = Server.stream_hash(stream).hex()
-            self.cache[path] = digest, mtime()
-        else:
-            digest = cache_result[0]
+        if cache_result and cache_result[0] == stat_key(st):
+            return cache_result[1]
+        return digest
 
-        etag = Server.parse_etag(etag_header)
-        return etag, digest
+    def hash_in_background(self, path: str, key: StatKey) -> None:
+        cache_result = self.cache.get(path)
+        if cache_result and cache_result[0] == key:
+            return
+
+        async def update() -> None:
+            try:
+                digest = await self.single_flight.run(
+                    ('digest', path, key),
+                    lambda: self.executors.io.submit(hash_file, path)
+                )
+            except ExecutorSaturated:
+                return
+            except OSError as e:
+                self.logger.debug('Unable to hash %s: %s', path, e)
+                return
+            self.cache[path] = key, digest
+
+        task = asyncio.ensure_future(update())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
     async def render_markdown(self,
                         url_path: 'StrOrBytesPath',
                         path: str,
                         raw: bool,
                         digest: str,
-                        send) -> list[bytes]:
-        body = compile_html(url_path,
-                            path,
-                            self.prefix,
-                            MARDOWN_EXTENSIONS,
-                            raw=raw).encode()
+                        send,
+                        cache_digest: Optional[str] = None,
+                        accept_encoding: Optional[str] = None) -> None:
+        key, body = await self.rendered_markdown(url_path, path, raw, cache_digest or digest)
+        self.logger.debug('Render cache: %s', self.render_cache.stats())
+        await self.send_rendered(send, key, body, b'text/html; charset=UTF-8', digest, accept_encoding)
+
+    async def rendered_markdown(self,
+                                url_path: 'StrOrBytesPath',
+                                path: str,
+                                raw: bool,
+                                cache_digest: str) -> tuple[tuple[Hashable, ...], bytes]:
+        if raw:
+            prefix = None
+        else:
+            prefix = self.prefix or relpath('/', start=dirname(os.fsdecode(url_path)))
+        key = (cache_digest, raw, prefix, tuple(MARDOWN_EXTENSIONS))
+        body = self.cached_render(key)
+        if body is None:
+            async def render() -> bytes:
+                stored = await self.load_rendered(key)
+                if stored is not None:
+                    return stored
+                with timed('render'):
+                    result, fingerprint, hashes = await self.executors.render.submit(markdown_to_html,
+                                                                                     url_path,
+                                                                                     path,
+                                                                                     prefix,
+                                                                                     MARDOWN_EXTENSIONS,
+                                                                                     raw)
+                self.store_rendered(key, result)
+                self.block_index.put(fingerprint, hashes)
+                return result
+
+            body = await self.single_flight.run(('markdown', path) + key, render)
+        return key, body
+
+    def streamed(self, st: stat_result) -> bool:
+        return 0 < self.stream_threshold <= st.st_size
+
+    async def stream_markdown(self, url_path: 'StrOrBytesPath', path: str, raw: bool, digest: str, send) -> None:
+        """Send the page as a render worker produces it, through a Unix socket it connects to"""
+        if raw:
+            prefix = None
+        else:
+            prefix = self.prefix or relpath('/', start=dirname(os.fsdecode(url_path)))
+        if self._stream_directory is None:
+            self._stream_directory = tempfile.mkdtemp(prefix='bugis-')
+        address = join(self._stream_directory, f'{next(self._streams)}.sock')
+        loop = asyncio.get_running_loop()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+            listener.bind(address)
+            listener.listen(1)
+            listener.setblocking(False)
+            try:
+                job = asyncio.ensure_future(self.executors.render.submit(stream_markdown, url_path, path, prefix,
+                                                                         MARDOWN_EXTENSIONS, raw, address))
+                accept = asyncio.ensure_future(loop.sock_accept(listener))
+                await asyncio.wait((job, accept), return_when=asyncio.FIRST_COMPLETED)
+                if not accept.done():
+                    # The worker failed before connecting
+                    accept.cancel()
+                    await job
+                connection, _ = await accept
+            finally:
+                os.unlink(address)
+        # The socket is drained as fast as the worker writes into it, whatever the pace of the client,
+        # so that a slow download never holds a render worker: the page is buffered here meanwhile
+        chunks: asyncio.Queue[bytes] = asyncio.Queue()
+
+        async def drain() -> None:
+            try:
+                with connection:
+                    while True:
+                        chunk = await loop.sock_recv(connection, 0x10000)
+                        if not chunk:
+                            break
+                        chunks.put_nowait(chunk)
+            finally:
+                chunks.put_nowait(b'')
+
+        reader = asyncio.ensure_future(drain())
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': (
+                    (b'Content-Type', b'text/html; charset=UTF-8'),
+                    (b'Etag', f'W/"{digest}"'.encode()),
+                    (b'Cache-Control', b'no-cache'),
+                )
+            })
+            end = False
+            while not end:
+                # Whatever the worker wrote since the last send goes out at once
+                buffer = [await chunks.get()]
+                while not chunks.empty():
+                    buffer.append(chunks.get_nowait())
+                end = not buffer[-1]
+                if len(buffer) > 1 or not end:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': b''.join(buffer),
+                        'more_body': True
+                    })
+        finally:
+            # Should the client have gone away, the worker fails as soon as it writes to the closed socket
+            reader.cancel()
+            reader.add_done_callback(lambda it: it.cancelled() or it.exception())
+            if not job.done():
+                job.add_done_callback(lambda it: it.cancelled() or it.exception())
+        # A failure of the worker leaves the response incomplete, rather than ending it as if it were whole
+        fingerprint, hashes = await job
+        self.block_index.put(fingerprint, hashes)
+        await send({
+            'type': 'http.response.body',
+            'body': b''
+        })
+
+    async def warm_up(self, documents: Sequence[str] = ()) -> None:
+        """Load Markdown and Pygments in every render worker, then render documents into the caches"""
+        start = monotonic()
+        workers = await asyncio.gather(*(
+            self.executors.render.submit(warm_up, MARDOWN_EXTENSIONS) for _ in range(self.executors.render_workers)
+        ))
+        self.logger.info('Warmed up %d render workers in %.3fs', len(set(workers)), monotonic() - start)
+        for url_path in documents:
+            start = monotonic()
+            relative_path = relpath(normpath(join('/', url_path)), start='/')
+            path = join(os.fsdecode(self.root_dir), relative_path)
+            try:
+                st = stat(path)
+                if not is_markdown(path) or not S_ISREG(st.st_mode):
+                    raise FileNotFoundError(path)
+                digest = await self.file_digest(path, st)
+                await self.rendered_markdown(normpath(join('/', relative_path)), path, False,
+                                             self.cache_digest(path, st, digest))
+            except OSError as e:
+                self.logger.warning('Unable to pre-render %s: %s', url_path, e)
+                continue
+            self.logger.info('Pre-rendered %s in %.3fs', url_path, monotonic() - start)
+
+    async def render_graph(self,
+                           path: str,
+                           prog: str,
+                           digest: str,
+                           send,
+                           cache_digest: Optional[str] = None,
+                           accept_encoding: Optional[str] = None) -> None:
+        key = ('graph', cache_digest or digest, prog)
+        error = self.graph_errors.get(key)
+        if error is None:
+            body = self.cached_render(key)
+            if body is None:
+                async def render() -> bytes:
+                    result = await self.load_rendered(key)
+                    if result is None:
+                        try:
+                            with timed('graph'):
+                                result = await self.graph_renderer.render(path, prog)
+                        except GraphvizTimeout:
+                            # Most likely the machine was busy, the next request tries again
+                            raise
+                        except GraphvizError as e:
+                            if len(self.graph_errors) >= 1024:
+                                # Drop the oldest, most likely about a version of a graph that is long gone
+                                del self.graph_errors[next(iter(self.graph_errors))]
+                            self.graph_errors[key] = e
+                            raise
+                        self.store_rendered(key, result)
+                    return result
+
+                try:
+                    body = await self.single_flight.run((path,) + key, render)
+                except GraphvizError as e:
+                    error = e
+        if error is None:
+            assert body is not None
+            await self.send_rendered(send, key, body, b'image/svg+xml; charset=UTF-8', digest, accept_encoding)
+        else:
+            self.logger.warning('Unable to render %s: %s', path, error)
+            await send({
+                'type': 'http.response.start',
+                'status': 504 if isinstance(error, GraphvizTimeout) else 500,
+                'headers': (
+                    (b'Content-Type', b'text/plain; charset=UTF-8'),
+                    (b'Etag', f'W/"{digest}"'.encode()),
+                    (b'Cache-Control', b'no-cache'),
+                )
+            })
+            await send({
+                'type': 'http.response.body',
+                'body': str(error).encode()
+            })
+
+    async def load_rendered(self, key: tuple[Hashable, ...]) -> Optional[bytes]:
+        if self.render_store is None:
+            return None
+        with timed('store'):
+            result = await self.executors.io.submit(self.render_store.get, key)
+        cache_lookup('store', result is not None)
+        if result is not None:
+            self.render_cache.put(key, result)
+        return result
+
+    def cached_render(self, key: tuple[Hashable, ...]) -> Optional[bytes]:
+        with timed('cache'):
+            result = self.render_cache.get(key)
+        cache_lookup('render', result is not None)
+        return result
+
+    def store_rendered(self, key: tuple[Hashable, ...], body: bytes) -> None:
+        self.render_cache.put(key, body)
+        if self.render_store is not None:
+            task = asyncio.ensure_future(self.executors.io.submit_unbounded(self.render_store.put, key, body))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def send_patch(self, path: str, base: str, digest: str, send, cache_digest: Optional[str] = None) -> None:
+        async def render() -> bytes:
+            with timed('render'):
+                result, fingerprint, hashes = await self.executors.render.submit(markdown_patch,
+                                                                                 path,
+                                                                                 MARDOWN_EXTENSIONS,
+                                                                                 self.block_index.get(base) or (),
+                                                                                 base)
+            self.block_index.put(fingerprint, hashes)
+            return result
+
+        body = await self.single_flight.run(('patch', path, cache_digest or digest, base), render)
         await send({
             'type': 'http.response.start',
             'status': 200,
             'headers': (
-                (b'Content-Type', b'text/html; charset=UTF-8'),
-                (b'Etag', f'W/{digest}'.encode()),
+                (b'Content-Type', b'application/json'),
+                (b'Etag', f'W/"{digest}"'.encode()),
                 (b'Cache-Control', b'no-cache'),
             )
         })
@@ -262,21 +670,143 @@ class Server:
             'type': 'http.response.body',
             'body': body
         })
-        return
+
+    async def send_rendered(self,
+                            send,
+                            key: tuple[Hashable, ...],
+                            body: bytes,
+                            content_type: bytes,
+                            digest: str,
+                            accept_encoding: Optional[str]) -> None:
+        headers = [
+            (b'Content-Type', content_type),
+            (b'Etag', f'W/"{digest}"'.encode()),
+            (b'Cache-Control', b'no-cache'),
+            (b'Vary', b'Accept-Encoding'),
+        ]
+        encoding = preferred_encoding(accept_encoding) if len(body) >= MIN_COMPRESSION_SIZE else None
+        if encoding:
+            encoded = self.render_cache.get_variant(key, encoding)
+            cache_lookup('compressed', encoded is not None)
+            if encoded is None:
+                identity = body
+
+                async def encode() -> bytes:
+                    with timed('compress'):
+                        result = await self.executors.io.submit(compress, identity, encoding)
+                    self.render_cache.put_variant(key, encoding, result)
+                    return result
+
+                encoded = await self.single_flight.run(('encode', encoding) + key, encode)
+            body = encoded
+            headers.append((b'Content-Encoding', encoding.encode()))
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': headers
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': body
+        })
+
     @staticmethod
-    async def not_modified(send, digest: str, cache_control=('Cache-Control', 'no-cache')) -> []:
+    async def not_modified(send,
+                           digest: str,
+                           cache_control=(b'Cache-Control', b'no-cache'),
+                           vary: bool = True,
+                           weak: bool = True) -> None:
+        """weak has to match the ETag of the 200 response, clients keep the one sent with the 304"""
+        headers = [
+            (b'Etag', (f'W/"{digest}"' if weak else f'"{digest}"').encode()),
+            cache_control
+        ]
+        if vary:
+            headers.append((b'Vary', b'Accept-Encoding'))
         await send({
             'type': 'http.response.start',
             'status': 304,
+            'headers': headers
+        })
+        await send({
+            'type': 'http.response.body',
+        })
+        return
+
+    async def send_search(self, directory: str, query_string: str, send) -> None:
+        assert self.search is not None
+        parameters = parse_qs(query_string)
+        try:
+            limit = min(100, max(1, int(parameters.get('limit', ['20'])[0])))
+        except ValueError:
+            limit = 20
+        query = parameters.get('search', [''])[0]
+        with timed('search'):
+            result = self.search.search(query, limit, directory)
+        if result is None:
+            # Still building the index
+            await self.service_unavailable(send)
+            return
+        total, hits = result
+        body = json.dumps({
+            'query': query,
+            'total': total,
+            'results': [{
+                'path': (self.prefix or '') + '/' + relpath(hit.path, os.fsdecode(self.root_dir)).replace(os.sep, '/'),
+                'title': hit.title,
+                'score': round(hit.score, 4),
+            } for hit in hits]
+        }).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
             'headers': (
-                (b'Etag', f'W/{digest}'.encode()),
-                cache_control
+                (b'Content-Type', b'application/json'),
+                (b'Cache-Control', b'no-cache'),
+            )
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': body
+        })
+
+    async def send_metrics(self, send) -> None:
+        assert self.metrics is not None
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': (
+                (b'Content-Type', b'text/plain; version=0.0.4; charset=UTF-8'),
+                (b'Cache-Control', b'no-cache'),
+            )
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': self.metrics.exposition()
+        })
+
+    def gauges(self) -> list[tuple[str, str, float]]:
+        return [
+            ('bugis_render_cache_entries', '', len(self.render_cache)),
+            ('bugis_render_cache_size_bytes', '', self.render_cache.size),
+            ('bugis_digest_cache_entries', '', len(self.cache)),
+            ('bugis_listing_cache_entries', '', len(self.listing_cache)),
+            ('bugis_pending_jobs', 'pool="io"', self.executors.io.pending),
+            ('bugis_pending_jobs', 'pool="render"', self.executors.render.pending),
+        ]
+
+    @staticmethod
+    async def service_unavailable(send, retry_after: int = 1) -> None:
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': (
+                (b'Retry-After', str(retry_after).encode()),
             )
         })
         await send({
             'type': 'http.response.body',
         })
-        return
 
     @staticmethod
     async def not_found(send) -> None:
@@ -288,23 +818,22 @@ class Server:
             'type': 'http.response.body',
         })
 
-    def directory_listing(self, path_info, path) -> str:
-        icon_path = join(self.prefix or '', 'markdown.svg')
-        title = "Directory listing for %s" % path_info
-        result = "<!DOCTYPE html><html><head>"
-        result += f'<link rel="icon" type="image/x-icon" href="{icon_path}">'
-        result += "<meta http-equiv=\"Content-Type\" content=\"text/html; charset=utf-8\">"
-        result += "<title>" + title + "</title></head>"
-        result += "<body><h1>" + title + "</h1><hr>"
-        result += "<ul>"
-        if path_info != '/':
-            result += "<li><a href=\"../\"/>../</li>"
-
-        def ls(filter):
-            return (entry for entry in sorted(listdir(path)) if filter(join(path, entry)))
-
-        for entry in ls(isdir):
-            result += '<li><a href="' + entry + '/' + '"/>' + entry + '/' + '</li>'
-        for entry in ls(lambda entry: isfile(entry) and is_markdown(entry)):
-            result += '<li><a href="' + entry + '"/>' + entry + '</li>'
-        return result
+    async def scan_directory(self, path: str, st: stat_result) -> Listing:
+        # Entries are dropped by the file watcher, the stat key covers changes it might miss
+        path = normpath(path)
+        key = stat_key(st)
+        cache_result = self.listing_cache.get(path)
+        hit = cache_result is not None and cache_result.stat == key
+        cache_lookup('listing', hit)
+        if cache_result is not None and hit:
+            return cache_result.listing
+        listing = await self.single_flight.run(
+            ('listing', path, key),
+            lambda: self.executors.io.submit(scan_directory, path)
+        )
+        self.listing_cache.put(path, CachedListing(key, listing))
+        return listing
+
+    def directory_listing(self, path_info: str, listing: Listing, page: int = 0) -> str:
+        icon_path = (self.prefix or '') + static_url('/markdown.svg')
+        return render_listing(path_info, icon_path, listing, page)
@@ -0,0 +1,274 @@
+import asyncio
+import fcntl
+import os
+from asyncio import AbstractEventLoop, StreamReader, StreamWriter, Task
+from logging import getLogger
+from os.path import dirname
+from typing import Callable, Optional
+
+from watchdog.observers import Observer
+from watchdog.observers.api import BaseObserver, ObservedWatch
+
+from .async_watchdog import Subscription, SubscriptionManager, SubscriptionEventHandler
+
+# Messages are NUL terminated, as no path can contain it, and start with their kind
+_SUBSCRIBE = b'+'
+_UNSUBSCRIBE = b'-'
+_FILE_CHANGED = b'f'
+_DIRECTORY_CHANGED = b'd'
+_WATCH_TREE = b'*'
+
+
+def _message(kind: bytes, path: str) -> bytes:
+    return kind + os.fsencode(path) + b'\0'
+
+
+class SharedFileWatcher:
+    """File watcher shared by all the workers of a deployment.
+
+    The worker that takes the lock on `<socket_path>.lock` becomes the leader: it owns the
+    watchdog observer and accepts the other workers on the Unix socket at socket_path.
+    Followers forward their subscriptions to the leader and receive the change notifications
+    of the paths they subscribed to, plus every directory change. Only the directories of the
+    paths that have live subscriptions, in any worker, are watched, unless a worker needs to learn
+    about every change below root. When the leader goes away the followers elect a new one and
+    subscribe again.
+    """
+    _loop: AbstractEventLoop
+    _socket_path: str
+    _subscription_manager: SubscriptionManager
+    _lock_fd: Optional[int]
+    _observer: Optional[BaseObserver]
+    _handler: SubscriptionEventHandler
+    # Leader state: remote subscribers by path, watches by directory with the number of watched paths in it
+    _remote: dict[str, set[StreamWriter]]
+    _watches: dict[str, tuple[int, ObservedWatch]]
+    # Followers that get every change below root, and the recursive watch of root
+    _tree_writers: set[StreamWriter]
+    _tree_watch: Optional[ObservedWatch]
+    # Follower state
+    _writer: Optional[StreamWriter]
+    _task: Task[None]
+
+    def __init__(self, socket_path: str, debounce: float = 0.1, retry_interval: float = 0.5,
+                 root: Optional[str] = None):
+        self._loop = asyncio.get_running_loop()
+        self._socket_path = socket_path
+        self._root = root or os.getcwd()
+        # Whether this worker forwards every change below root
+        self._tree = False
+        self._retry_interval = retry_interval
+        self._subscription_manager = SubscriptionManager(self._loop, debounce, self._watch)
+        self._subscription_manager.add_forwarder(self._forward)
+        self._handler = SubscriptionEventHandler(self._subscription_manager)
+        self._lock_fd = None
+        self._observer = None
+        self._remote = dict()
+        self._watches = dict()
+        self._tree_writers = set()
+        self._tree_watch = None
+        self._writer = None
+        self.logger = getLogger(SharedFileWatcher.__name__)
+        self._task = self._loop.create_task(self._run())
+
+    @property
+    def leader(self) -> bool:
+        return self._observer is not None
+
+    def subscribe(self, path: str) -> Subscription:
+        return self._subscription_manager.subscribe(path)
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """Call listener on the event loop with the path of every directory whose entries change"""
+        self._subscription_manager.add_listener(listener)
+
+    def add_observer(self, observer: Callable[[str], None]) -> None:
+        """Call observer on the event loop with every changed file this worker is notified about anyway,
+        the subscribed ones and the others in their directories, without watching anything more"""
+        self._subscription_manager.add_forwarder(observer)
+
+    def add_forwarder(self, forwarder: Callable[[str], None]) -> None:
+        """Call forwarder on the event loop with every file that changes below root"""
+        self._subscription_manager.add_forwarder(forwarder)
+        if not self._tree:
+            self._tree = True
+            if self._observer is not None:
+                self._watch_tree()
+            elif self._writer is not None:
+                self._writer.write(_message(_WATCH_TREE, self._root))
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self._observer is not None:
+            observer = self._observer
+
+            def _observer_stop() -> None:
+                observer.stop()
+                observer.join()
+
+            await self._loop.run_in_executor(None, _observer_stop)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+
+    def _try_lock(self) -> bool:
+        fd = os.open(f'{self._socket_path}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            if self._try_lock():
+                await self._lead()
+                return
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self._socket_path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The leader is starting up or has just gone away
+                await asyncio.sleep(self._retry_interval)
+                continue
+            self.logger.debug('Following the file watcher at %s', self._socket_path)
+            for path in self._subscription_manager.paths():
+                self._writer.write(_message(_SUBSCRIBE, path))
+            if self._tree:
+                self._writer.write(_message(_WATCH_TREE, self._root))
+            await self._follow(reader)
+            self._writer = None
+            self.logger.info('File watcher leader went away, electing a new one')
+            # Whatever happened in the meantime went unnoticed
+            for path in self._subscription_manager.paths():
+                self._subscription_manager.post_event(path)
+
+    async def _lead(self) -> None:
+        self.logger.info('Leading the file watcher at %s', self._socket_path)
+        try:
+            os.unlink(self._socket_path)
+        except FileNotFoundError:
+            pass
+        self._observer = Observer()
+        for path in self._subscription_manager.paths():
+            self._add_watch(path)
+        if self._tree:
+            self._watch_tree()
+        await self._loop.run_in_executor(None, self._observer.start)
+        server = await asyncio.start_unix_server(self._serve, self._socket_path)
+        async with server:
+            await server.serve_forever()
+
+    async def _follow(self, reader: StreamReader) -> None:
+        try:
+            while True:
+                message = await reader.readuntil(b'\0')
+                kind, path = message[:1], os.fsdecode(message[1:-1])
+                if kind == _FILE_CHANGED:
+                    self._subscription_manager.post_event(path)
+                elif kind == _DIRECTORY_CHANGED:
+                    self._subscription_manager.post_directory_event(path)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def _serve(self, reader: StreamReader, writer: StreamWriter) -> None:
+        listener = self._directory_forwarder(writer)
+        self._subscription_manager.add_listener(listener)
+        subscribed = set[str]()
+        try:
+            while True:
+                message = await reader.readuntil(b'\0')
+                kind, path = message[:1], os.fsdecode(message[1:-1])
+                if kind == _SUBSCRIBE and path not in subscribed:
+                    subscribed.add(path)
+                    writers = self._remote.setdefault(path, set())
+                    writers.add(writer)
+                    if len(writers) == 1 and not self._subscription_manager.subscribed(path):
+                        self._add_watch(path)
+                elif kind == _UNSUBSCRIBE and path in subscribed:
+                    subscribed.discard(path)
+                    self._remove_remote(path, writer)
+                elif kind == _WATCH_TREE:
+                    self._tree_writers.add(writer)
+                    self._watch_tree()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._subscription_manager.remove_listener(listener)
+            for path in subscribed:
+                self._remove_remote(path, writer)
+            self._tree_writers.discard(writer)
+            if not self._tree_writers and not self._tree and self._tree_watch is not None:
+                assert self._observer is not None
+                self._observer.unschedule(self._tree_watch)
+                self._tree_watch = None
+            writer.close()
+
+    def _remove_remote(self, path: str, writer: StreamWriter) -> None:
+        writers = self._remote.get(path)
+        if writers is None:
+            return
+        writers.discard(writer)
+        if not writers:
+            del self._remote[path]
+            if not self._subscription_manager.subscribed(path):
+                self._remove_watch(path)
+
+    @staticmethod
+    def _directory_forwarder(writer: StreamWriter) -> Callable[[str], None]:
+        def forward(directory: str) -> None:
+            if not writer.is_closing():
+                writer.write(_message(_DIRECTORY_CHANGED, directory))
+
+        return forward
+
+    def _forward(self, path: str) -> None:
+        for writer in self._remote.get(path, set()) | self._tree_writers:
+            if not writer.is_closing():
+                writer.write(_message(_FILE_CHANGED, path))
+
+    def _watch(self, path: str, watched: bool) -> None:
+        if self._observer is not None:
+            if path in self._remote:
+                return
+            if watched:
+                self._add_watch(path)
+            else:
+                self._remove_watch(path)
+        elif self._writer is not None:
+            self._writer.write(_message(_SUBSCRIBE if watched else _UNSUBSCRIBE, path))
+
+    def _watch_tree(self) -> None:
+        # Overlaps with the watches of the single directories, the subscription manager coalesces the duplicates
+        assert self._observer is not None
+        if self._tree_watch is None:
+            try:
+                self._tree_watch = self._observer.schedule(self._handler, self._root, recursive=True)
+            except OSError as e:
+                self.logger.warning('Unable to watch %s: %s', self._root, e)
+
+    def _add_watch(self, path: str) -> None:
+        assert self._observer is not None
+        directory = dirname(path)
+        count, watch = self._watches.get(directory, (0, None))
+        if watch is None:
+            try:
+                watch = self._observer.schedule(self._handler, directory, recursive=False)
+            except OSError as e:
+                self.logger.warning('Unable to watch %s: %s', directory, e)
+                return
+        self._watches[directory] = count + 1, watch
+
+    def _remove_watch(self, path: str) -> None:
+        assert self._observer is not None
+        directory = dirname(path)
+        count, watch = self._watches.get(directory, (0, None))
+        if watch is None:
+            return
+        if count > 1:
+            self._watches[directory] = count - 1, watch
+        else:
+            del self._watches[directory]
+            self._observer.unschedule(watch)
@@ -0,0 +1,32 @@
+import asyncio
+from asyncio import Future
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    _calls: dict[Hashable, Future[Any]]
+
+    def __init__(self) -> None:
+        self._calls = dict()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+
+            def forget(f: Future[T]) -> None:
+                if self._calls.get(key) is f:
+                    del self._calls[key]
+                if not f.cancelled():
+                    # Mark the exception as retrieved even if every waiter went away
+                    f.exception()
+
+            future.add_done_callback(forget)
+        # A waiter being cancelled must not cancel the shared call
+        return await asyncio.shield(future)
@@ -0,0 +1,98 @@
+import os
+from os import stat_result
+from time import monotonic
+from typing import Mapping, Optional, Union
+
+from .metrics import cache_lookup
+
+
+class StatCache:
+    """Results of os.stat by path, including the paths that do not exist, kept for at most ttl seconds.
+
+    Entries are dropped as soon as the file watcher reports a change to their path, the time to live
+    only bounds how long changes the watcher cannot see (e.g. those made by other NFS clients) go unnoticed.
+    """
+    _ttl: float
+    _max_entries: int
+    _entries: dict[str, tuple[float, stat_result]]
+    _missing: dict[str, float]
+    # Missing paths by their parent directory
+    _children: dict[str, set[str]]
+
+    def __init__(self, ttl: float = 1.0, max_entries: int = 0x10000):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = dict()
+        self._missing = dict()
+        self._children = dict()
+
+    def stat(self, path: str) -> Optional[stat_result]:
+        """Like os.stat, but returns None for missing paths"""
+        if self._ttl <= 0:
+            try:
+                return os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                return None
+        now = monotonic()
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] > now:
+            cache_lookup('stat', True)
+            return entry[1]
+        expiry = self._missing.get(path)
+        if expiry is not None and expiry > now:
+            cache_lookup('stat', True)
+            return None
+        cache_lookup('stat', False)
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            self._forget_missing(path)
+            if len(self._missing) >= self._max_entries:
+                for key in self._expired(self._missing, now):
+                    self._forget_missing(key)
+            self._missing[path] = now + self._ttl
+            self._children.setdefault(os.path.dirname(path), set()).add(path)
+            return None
+        self._entries.pop(path, None)
+        if len(self._entries) >= self._max_entries:
+            for key in self._expired(self._entries, now):
+                del self._entries[key]
+        self._entries[path] = now + self._ttl, st
+        return st
+
+    @staticmethod
+    def _expired(entries: Mapping[str, Union[float, tuple[float, stat_result]]], now: float) -> list[str]:
+        # Entries are in order of expiry, pick the expired ones or else the oldest quarter
+        expired = 0
+        for value in entries.values():
+            if (value[0] if isinstance(value, tuple) else value) > now:
+                break
+            expired += 1
+        return list(entries)[:max(expired, len(entries) // 4)]
+
+    def _forget_missing(self, path: str) -> None:
+        if self._missing.pop(path, None) is not None:
+            directory = os.path.dirname(path)
+            children = self._children[directory]
+            children.discard(path)
+            if not children:
+                del self._children[directory]
+
+    def invalidate(self, path: str) -> None:
+        self._entries.pop(path, None)
+        self._forget_missing(path)
+
+    def invalidate_directory(self, directory: str) -> None:
+        """Forget directory and the missing paths in it, after its entries changed.
+
+        Missing paths further below are left to expire, the directory event does not tell which
+        subdirectory appeared and looking at all of them would stall the loop on large trees.
+        """
+        self.invalidate(directory)
+        for path in self._children.pop(directory, ()):
+            del self._missing[path]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._missing.clear()
+        self._children.clear()
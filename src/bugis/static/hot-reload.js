@@ -1,13 +1,17 @@
+function update(xmlhttp) {
+    if (xmlhttp.status == 200) {
+        document.querySelector("article.markdown-body").innerHTML = xmlhttp.responseText;
+    } else if(xmlhttp.status == 304) {
+    } else {
+        console.log(xmlhttp.status, xmlhttp.statusText);
+    }
+}
+
 function req(first) {
     const start = new Date().getTime();
     const xmlhttp = new XMLHttpRequest();
     xmlhttp.onload = function() {
-        if (xmlhttp.status == 200) {
-            document.querySelector("article.markdown-body").innerHTML = xmlhttp.responseText;
-        } else if(xmlhttp.status == 304) {
-        } else {
-            console.log(xmlhttp.status, xmlhttp.statusText);
-        }
+        update(xmlhttp);
         const nextCall = Math.min(1000, Math.max(0, 1000 - (new Date().getTime() - start)));
         setTimeout(req, nextCall, false);
     };
@@ -18,4 +22,106 @@ function req(first) {
     xmlhttp.open("GET", location.pathname + "?reload", true);
     xmlhttp.send();
 }
-req(true);
+
+function fetchRaw() {
+    const xmlhttp = new XMLHttpRequest();
+    xmlhttp.onload = function() {
+        update(xmlhttp);
+    };
+    xmlhttp.open("GET", location.pathname + "?raw", true);
+    xmlhttp.send();
+}
+
+function currentDocument(article) {
+    for (const node of article.childNodes) {
+        if (node.nodeType == Node.COMMENT_NODE && node.data.startsWith("document:")) {
+            return node.data.substring(9);
+        }
+    }
+    return null;
+}
+
+function applyPatch(article, patch) {
+    if (currentDocument(article) !== patch.base) {
+        // Another patch was applied since this one was requested, its indices refer to blocks that are gone
+        return false;
+    }
+    const blocks = [];
+    for (const node of Array.from(article.childNodes)) {
+        if (node.nodeType == Node.COMMENT_NODE && node.data.startsWith("block:")) {
+            blocks.push([node]);
+        } else if (node.nodeType == Node.COMMENT_NODE && node.data.startsWith("document:")) {
+            // Streamed pages have it after the last block
+            continue;
+        } else if (blocks.length > 0) {
+            blocks[blocks.length - 1].push(node);
+        }
+    }
+    const used = new Set();
+    const fragment = document.createDocumentFragment();
+    fragment.appendChild(document.createComment("document:" + patch.document));
+    for (const [first, second] of patch.operations) {
+        if (typeof first === "number") {
+            if (first + second > blocks.length) {
+                return false;
+            }
+            for (let i = first; i < first + second; i++) {
+                for (const node of blocks[i]) {
+                    // The same block can be copied more than once
+                    fragment.appendChild(used.has(i) ? node.cloneNode(true) : node);
+                }
+                used.add(i);
+            }
+        } else {
+            const template = document.createElement("template");
+            template.innerHTML = "<!--block:" + first + "-->\n" + second + "\n";
+            fragment.appendChild(template.content);
+        }
+    }
+    article.replaceChildren(fragment);
+    return true;
+}
+
+function fetchPatch() {
+    const article = document.querySelector("article.markdown-body");
+    const base = currentDocument(article);
+    if (base === null) {
+        fetchRaw();
+        return;
+    }
+    const xmlhttp = new XMLHttpRequest();
+    xmlhttp.onload = function() {
+        if (xmlhttp.status != 200 || !applyPatch(article, JSON.parse(xmlhttp.responseText))) {
+            fetchRaw();
+        }
+    };
+    xmlhttp.onerror = fetchRaw;
+    xmlhttp.open("GET", location.pathname + "?patch=" + base, true);
+    xmlhttp.send();
+}
+
+function subscribe() {
+    const source = new EventSource(location.pathname + "?events");
+    let connected = false;
+    source.onopen = function() {
+        if (connected) {
+            // Changes may have been missed while reconnecting
+            fetchPatch();
+        }
+        connected = true;
+    };
+    source.addEventListener("change", fetchPatch);
+    source.onerror = function() {
+        if (source.readyState == EventSource.CLOSED) {
+            // The server does not support Server-Sent Events, fall back to long polling
+            source.close();
+            req(true);
+        }
+    };
+}
+
+if (window.EventSource) {
+    subscribe();
+} else {
+    req(true);
+}
@@ -0,0 +1,51 @@
+from mimetypes import guess_type
+from os.path import basename
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+from .compression import ENCODERS, MIN_COMPRESSION_SIZE, compress
+from .md2html import load_static, static_url, STATIC_RESOURCES
+
+Headers = tuple[tuple[bytes, bytes], ...]
+
+
+class StaticResponse(NamedTuple):
+    digest: str
+    headers: Headers
+    body: bytes
+    # Headers and body by content coding, empty for resources too small to be worth compressing
+    variants: Mapping[str, tuple[Headers, bytes]]
+    not_modified: Headers
+
+
+def _response(resource: str, encoded: Mapping[str, bytes], cache_control: tuple[bytes, bytes]) -> StaticResponse:
+    content, digest = load_static(resource)
+    mime_type = guess_type(basename(resource))[0] or 'application/octet-stream'
+    etag = (b'Etag', f'W/"{digest}"'.encode())
+    vary = (b'Vary', b'Accept-Encoding')
+    headers: Headers = (
+        (b'Content-Type', f'{mime_type}; charset=UTF-8'.encode()),
+        etag,
+        cache_control,
+        vary,
+    )
+    variants = {
+        encoding: (headers + ((b'Content-Encoding', encoding.encode()),), body)
+        for encoding, body in encoded.items()
+    }
+    return StaticResponse(digest, headers, content, MappingProxyType(variants), (etag, cache_control, vary))
+
+
+def build_static_table() -> Mapping[str, StaticResponse]:
+    """Ready made responses for the static resources, by their plain and their fingerprinted URL"""
+    table: dict[str, StaticResponse] = {}
+    for resource in STATIC_RESOURCES:
+        content = load_static(resource)[0]
+        encoded = {
+            encoding: compress(content, encoding, best=True) for encoding in ENCODERS
+        } if len(content) >= MIN_COMPRESSION_SIZE else {}
+        table[resource] = _response(resource, encoded, (b'Cache-Control', b'must-revalidate, max-age=86400'))
+        table[static_url(resource)] = _response(
+            resource, encoded, (b'Cache-Control', b'public, max-age=31536000, immutable')
+        )
+    return MappingProxyType(table)
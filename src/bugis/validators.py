@@ -0,0 +1,40 @@
+import hashlib
+from os import stat_result
+from typing import TYPE_CHECKING, Any, Callable
+
+if TYPE_CHECKING:
+    from _typeshed import StrOrBytesPath
+
+try:
+    import xxhash
+
+    content_hasher: Callable[[], Any] = xxhash.xxh3_128
+except ImportError:
+    # SHA-1 is hardware accelerated on most CPUs and sensibly faster than md5
+    content_hasher = hashlib.sha1
+
+StatKey = tuple[int, int, int, int]
+
+
+def stat_key(st: stat_result) -> StatKey:
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def stat_validator(st: stat_result) -> str:
+    return f'{st.st_dev:x}-{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}'
+
+
+def hash_file(path: 'StrOrBytesPath', bufsize: int = 0x100000) -> str:
+    if bufsize <= 0:
+        raise ValueError("Buffer size must be greater than 0")
+    hasher = content_hasher()
+    buffer = bytearray(bufsize)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            hasher.update(view[:size])
+    digest: str = hasher.hexdigest()
+    return digest
@@ -0,0 +1,65 @@
+import gzip
+import unittest
+
+from bugis.compression import compress, negotiate, parse_accept_encoding
+
+AVAILABLE = ['br', 'gzip']
+
+
+class ParseAcceptEncodingTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual({}, parse_accept_encoding(None))
+        self.assertEqual({}, parse_accept_encoding(''))
+        self.assertEqual(
+            {'gzip': 1.0, 'br': 0.5, 'identity': 0.0, '*': 0.1},
+            parse_accept_encoding('GZIP, br ; q=0.5,identity;q=0, *;Q=0.1,')
+        )
+
+    def test_invalid_weight(self):
+        self.assertEqual({'gzip': 0.0}, parse_accept_encoding('gzip;q=high'))
+
+
+class NegotiateTest(unittest.TestCase):
+
+    def test_no_header(self):
+        self.assertIsNone(negotiate(None, AVAILABLE))
+        self.assertIsNone(negotiate('', AVAILABLE))
+
+    def test_preference(self):
+        self.assertEqual('gzip', negotiate('gzip', AVAILABLE))
+        self.assertEqual('gzip', negotiate('br;q=0.5, gzip', AVAILABLE))
+        # Ties go to the order of the available codings
+        self.assertEqual('br', negotiate('gzip, br', AVAILABLE))
+        self.assertIsNone(negotiate('deflate', AVAILABLE))
+
+    def test_zero_weight(self):
+        self.assertIsNone(negotiate('gzip;q=0', AVAILABLE))
+        self.assertEqual('gzip', negotiate('br;q=0, gzip;q=0.1', AVAILABLE))
+
+    def test_identity(self):
+        self.assertIsNone(negotiate('identity', AVAILABLE))
+        self.assertIsNone(negotiate('gzip;q=0.5, identity', AVAILABLE))
+        self.assertEqual('gzip', negotiate('gzip, identity', AVAILABLE))
+        self.assertEqual('gzip', negotiate('gzip;q=0.5, identity;q=0', AVAILABLE))
+
+    def test_wildcard(self):
+        self.assertEqual('br', negotiate('*', AVAILABLE))
+        self.assertEqual('gzip', negotiate('*;q=0.5, gzip', AVAILABLE))
+        # Codings named explicitly take precedence over the wildcard
+        self.assertEqual('gzip', negotiate('br;q=0, *', AVAILABLE))
+        self.assertIsNone(negotiate('*;q=0', AVAILABLE))
+        self.assertIsNone(negotiate('*;q=0, identity', AVAILABLE))
+
+
+class CompressTest(unittest.TestCase):
+
+    def test_gzip(self):
+        data = b'text ' * 1000
+        self.assertEqual(data, gzip.decompress(compress(data, 'gzip')))
+        # No timestamp, the same input always compresses to the same output
+        self.assertEqual(compress(data, 'gzip', best=True), compress(data, 'gzip', best=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from bugis.file_sender import RangeNotSatisfiable, if_range_matches, parse_range
+
+ETAG = '"0123456789abcdef"'
+LAST_MODIFIED = 'Sat, 17 Oct 2026 10:00:00 GMT'
+
+
+class ParseRangeTest(unittest.TestCase):
+
+    def test_no_range(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertIsNone(parse_range('', 100))
+
+    def test_ranges(self):
+        self.assertEqual((0, 9), parse_range('bytes=0-9', 100))
+        self.assertEqual((10, 99), parse_range('bytes=10-', 100))
+        # The end is clamped to the last byte
+        self.assertEqual((90, 99), parse_range('bytes=90-1000', 100))
+        self.assertEqual((0, 0), parse_range('Bytes = 0-0', 100))
+
+    def test_suffix_ranges(self):
+        self.assertEqual((90, 99), parse_range('bytes=-10', 100))
+        # A suffix longer than the representation selects all of it
+        self.assertEqual((0, 99), parse_range('bytes=-1000', 100))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=-0', 100)
+
+    def test_start_past_the_end(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=100-', 100)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=200-300', 100)
+
+    def test_empty_file(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=0-', 0)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=0-10', 0)
+        self.assertIsNone(parse_range('bytes=-10', 0))
+
+    def test_whole_representation(self):
+        for header in ('bytes=0-9,20-29', 'bytes=-5, 0-1', 'items=0-9', 'bytes=9-0', 'bytes=a-b', 'bytes=-', 'bytes'):
+            with self.subTest(header):
+                self.assertIsNone(parse_range(header, 100))
+
+
+class IfRangeTest(unittest.TestCase):
+
+    def test_absent(self):
+        self.assertTrue(if_range_matches(None, ETAG, LAST_MODIFIED))
+
+    def test_strong_etag(self):
+        self.assertTrue(if_range_matches(ETAG, ETAG, LAST_MODIFIED))
+        self.assertTrue(if_range_matches(f' {ETAG} ', ETAG, LAST_MODIFIED))
+        self.assertFalse(if_range_matches('"fedcba9876543210"', ETAG, LAST_MODIFIED))
+
+    def test_weak_etag(self):
+        # Weak validators never match in If-Range, even for the current representation
+        self.assertFalse(if_range_matches(f'W/{ETAG}', ETAG, LAST_MODIFIED))
+
+    def test_date(self):
+        self.assertTrue(if_range_matches(LAST_MODIFIED, ETAG, LAST_MODIFIED))
+        self.assertFalse(if_range_matches('Fri, 16 Oct 2026 10:00:00 GMT', ETAG, LAST_MODIFIED))
+
+
+if __name__ == '__main__':
+    unittest.main()
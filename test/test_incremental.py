@@ -0,0 +1,55 @@
+import re
+import unittest
+from os.path import dirname, join
+
+import markdown
+
+from bugis.incremental import BlockRenderer, split_blocks
+
+# Blocks are joined with a single newline, the whole document may have more between them
+_BLANK_LINES = re.compile(r'\n\n+')
+
+EXTENSIONS = ['extra', 'smarty', 'tables', 'codehilite']
+
+DOCUMENTS = {
+    'definition lists': 'Term\n: definition\n\nTerm 2\n: definition 2\n\nA paragraph\n\nTerm 3\n: definition 3\n',
+    'loose definition lists': 'Term\n\n: definition\n\n: another one\n\nTerm 2\n: definition 2\n',
+    'loose terms': 'Term\n: definition\n\nTerm 2\n\n: definition 2\n\nA paragraph\n\nTerm 3\n\n: definition 3\n',
+    'loose lists': '* one\n\n* two\n\n    continued\n\n* three\n\nAfter\n\n1. first\n\n2. second\n',
+    'html blocks': '<div>\n\nnot markdown\n\n<p>nested</p>\n\n</div>\n\n# Title\n\n<!--\n\ncomment\n\n-->\n\ntext\n',
+    'reference links': 'See [the docs][docs] and [this][].\n\n# Title\n\n[docs]: https://example.com/docs\n'
+                       '[this]: https://example.com/this "Title"\n\nMore [docs] here.\n',
+    'tilde fences': '~~~python\ndef f():\n\n    return 1\n\n# not a title\n~~~\n\nafter\n\n````\n~~~\n\ninside\n````\n',
+    'backtick fences': '```\n\n[x]: https://example.com\n\n```\n\ntext [x]\n',
+    'tables': '| a | b |\n|---|---|\n| 1 | 2 |\n\nText\n\n| c |\n|---|\n| 3 |\n',
+    'block quotes': '> quoted\n\n> still quoted\n\nplain\n',
+}
+
+
+class BlockEquivalenceTest(unittest.TestCase):
+    """Rendering a document a block at a time must give what rendering it whole gives"""
+    maxDiff = None
+
+    def assert_equivalent(self, source: str) -> None:
+        expected = markdown.markdown(source, extensions=EXTENSIONS)
+        document = BlockRenderer().render(source, EXTENSIONS)
+        self.assertEqual(_BLANK_LINES.sub('\n', expected), _BLANK_LINES.sub('\n', '\n'.join(document.blocks)))
+
+    def test_constructs(self):
+        for name, source in DOCUMENTS.items():
+            with self.subTest(name):
+                self.assert_equivalent(source)
+
+    def test_readme(self):
+        with open(join(dirname(__file__), 'README.md')) as f:
+            self.assert_equivalent(f.read())
+
+    def test_definition_list_is_one_block(self):
+        self.assertEqual(
+            ['Term\n: definition\n\nTerm 2\n: definition 2', 'Paragraph'],
+            list(split_blocks('Term\n: definition\n\nTerm 2\n: definition 2\n\nParagraph\n'))
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
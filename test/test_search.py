@@ -0,0 +1,51 @@
+import unittest
+from collections import Counter
+
+from bugis.search import Analysis, Search, SearchIndex
+
+
+def _analysis(*terms: str) -> Analysis:
+    return Analysis('Title', len(terms), Counter(terms))
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def test_reindexed_documents_count_once(self):
+        index = SearchIndex()
+        for n in range(4):
+            index.add(f'/docs/{n}.md', _analysis('word', f'unique{n}'))
+        # Too few removals for a compaction, the postings of the previous versions are still there
+        for n in range(3):
+            index.add(f'/docs/{n}.md', _analysis('word', 'again'))
+        matches, hits = index.search('word')
+        self.assertEqual(4, matches)
+        self.assertTrue(all(it.score > 0 for it in hits))
+
+    def test_removed_documents_do_not_match(self):
+        index = SearchIndex()
+        index.add('/docs/a.md', _analysis('word'))
+        index.add('/docs/b.md', _analysis('word'))
+        index.remove('/docs/a.md')
+        matches, hits = index.search('word')
+        self.assertEqual((1, ['/docs/b.md']), (matches, [it.path for it in hits]))
+        index.remove('/docs/b.md')
+        self.assertEqual((0, []), index.search('word'))
+
+
+class SearchTest(unittest.TestCase):
+
+    def test_only_changes_below_root_are_indexed(self):
+        search = Search('/docs', None)  # type: ignore[arg-type]
+        search.document_changed('/docs2/a.md')
+        search.document_changed('/docs/.git/a.md')
+        search.document_changed('/docs/.hidden.md')
+        search.directory_changed('/docs2')
+        search.directory_changed('/docs/.cache')
+        self.assertEqual({}, search._dirty)
+        search.document_changed('/docs/sub/a.md')
+        search.directory_changed('/docs')
+        self.assertEqual({'/docs/sub/a.md': False, '/docs': True}, search._dirty)
+
+
+if __name__ == '__main__':
+    unittest.main()
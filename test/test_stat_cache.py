@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+from os.path import join
+from unittest.mock import patch
+
+from bugis.stat_cache import StatCache
+
+
+class StatCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = self.directory.name
+        self.now = 1000.0
+        clock = patch('bugis.stat_cache.monotonic', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def create(self, *names: str) -> str:
+        path = join(self.root, *names)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('content')
+        return path
+
+    def test_negative_entries(self):
+        cache = StatCache(ttl=10)
+        path = join(self.root, 'a.md')
+        self.assertIsNone(cache.stat(path))
+        self.create('a.md')
+        # Still cached as missing until it expires
+        self.assertIsNone(cache.stat(path))
+        self.now += 11
+        self.assertIsNotNone(cache.stat(path))
+
+    def test_missing_parent(self):
+        cache = StatCache(ttl=10)
+        file = self.create('file')
+        self.assertIsNone(cache.stat(join(file, 'child')))
+
+    def test_positive_entries(self):
+        cache = StatCache(ttl=10)
+        path = self.create('a.md')
+        st = cache.stat(path)
+        self.assertIsNotNone(st)
+        os.unlink(path)
+        self.assertIs(st, cache.stat(path))
+        cache.invalidate(path)
+        self.assertIsNone(cache.stat(path))
+
+    def test_invalidate(self):
+        cache = StatCache(ttl=10)
+        path = join(self.root, 'a.md')
+        self.assertIsNone(cache.stat(path))
+        self.create('a.md')
+        cache.invalidate(path)
+        self.assertIsNotNone(cache.stat(path))
+
+    def test_invalidate_directory(self):
+        cache = StatCache(ttl=10)
+        child = join(self.root, 'a.md')
+        nested = join(self.root, 'sub', 'b.md')
+        for path in (child, nested):
+            self.assertIsNone(cache.stat(path))
+        self.create('a.md')
+        self.create('sub', 'b.md')
+        cache.invalidate_directory(self.root)
+        self.assertIsNotNone(cache.stat(child))
+        # Missing paths further below are left to expire
+        self.assertIsNone(cache.stat(nested))
+        self.now += 11
+        self.assertIsNotNone(cache.stat(nested))
+
+    def test_invalidate_directory_drops_the_directory(self):
+        cache = StatCache(ttl=10)
+        directory = join(self.root, 'sub')
+        self.assertIsNone(cache.stat(directory))
+        self.create('sub', 'b.md')
+        cache.invalidate_directory(directory)
+        self.assertIsNotNone(cache.stat(directory))
+
+    def test_bounded(self):
+        cache = StatCache(ttl=10, max_entries=8)
+        for n in range(100):
+            self.assertIsNone(cache.stat(join(self.root, f'{n}.md')))
+            self.now += 0.01
+        self.assertLessEqual(len(cache._missing), 8)
+        self.assertEqual(set(cache._missing), cache._children[self.root])
+
+    def test_disabled(self):
+        cache = StatCache(ttl=0)
+        path = join(self.root, 'a.md')
+        self.assertIsNone(cache.stat(path))
+        self.create('a.md')
+        self.assertIsNotNone(cache.stat(path))
+
+
+if __name__ == '__main__':
+    unittest.main()